@@ -62,7 +62,23 @@ get_ipython().run_cell_magic('bash', '', 'mkdir -p trainer\ntouch trainer/__init
 # In[6]:
 
 
-get_ipython().run_cell_magic('writefile', 'trainer/util.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport os\nfrom six.moves import urllib\nimport tempfile\n\nimport numpy as np\nimport pandas as pd\nimport tensorflow as tf\n\n# Storage directory\nDATA_DIR = os.path.join(tempfile.gettempdir(), \'census_data\')\n\n# Download options.\nDATA_URL = (\n    \'https://storage.googleapis.com/cloud-samples-data/ai-platform/census\'\n    \'/data\')\nTRAINING_FILE = \'adult.data.csv\'\nEVAL_FILE = \'adult.test.csv\'\nTRAINING_URL = \'%s/%s\' % (DATA_URL, TRAINING_FILE)\nEVAL_URL = \'%s/%s\' % (DATA_URL, EVAL_FILE)\n\n# These are the features in the dataset.\n# Dataset information: https://archive.ics.uci.edu/ml/datasets/census+income\n_CSV_COLUMNS = [\n    \'age\', \'workclass\', \'fnlwgt\', \'education\', \'education_num\',\n    \'marital_status\', \'occupation\', \'relationship\', \'race\', \'gender\',\n    \'capital_gain\', \'capital_loss\', \'hours_per_week\', \'native_country\',\n    \'income_bracket\'\n]\n\n# This is the label (target) we want to predict.\n_LABEL_COLUMN = \'income_bracket\'\n\n# These are columns we will not use as features for training. There are many\n# reasons not to use certain attributes of data for training. Perhaps their\n# values are noisy or inconsistent, or perhaps they encode bias that we do not\n# want our model to learn. For a deep dive into the features of this Census\n# dataset and the challenges they pose, see the Introduction to ML Fairness\n# Notebook: https://colab.research.google.com/github/google/eng-edu/blob\n# /master/ml/cc/exercises/intro_to_fairness.ipynb\nUNUSED_COLUMNS = [\'fnlwgt\', \'education\', \'gender\']\n\n_CATEGORICAL_TYPES = {\n    \'workclass\': pd.api.types.CategoricalDtype(categories=[\n        \'Federal-gov\', \'Local-gov\', \'Never-worked\', \'Private\', \'Self-emp-inc\',\n        \'Self-emp-not-inc\', \'State-gov\', \'Without-pay\'\n    ]),\n    \'marital_status\': pd.api.types.CategoricalDtype(categories=[\n        \'Divorced\', \'Married-AF-spouse\', \'Married-civ-spouse\',\n        \'Married-spouse-absent\', \'Never-married\', \'Separated\', \'Widowed\'\n    ]),\n    \'occupation\': pd.api.types.CategoricalDtype([\n        \'Adm-clerical\', \'Armed-Forces\', \'Craft-repair\', \'Exec-managerial\',\n        \'Farming-fishing\', \'Handlers-cleaners\', \'Machine-op-inspct\',\n        \'Other-service\', \'Priv-house-serv\', \'Prof-specialty\', \'Protective-serv\',\n        \'Sales\', \'Tech-support\', \'Transport-moving\'\n    ]),\n    \'relationship\': pd.api.types.CategoricalDtype(categories=[\n        \'Husband\', \'Not-in-family\', \'Other-relative\', \'Own-child\', \'Unmarried\',\n        \'Wife\'\n    ]),\n    \'race\': pd.api.types.CategoricalDtype(categories=[\n        \'Amer-Indian-Eskimo\', \'Asian-Pac-Islander\', \'Black\', \'Other\', \'White\'\n    ]),\n    \'native_country\': pd.api.types.CategoricalDtype(categories=[\n        \'Cambodia\', \'Canada\', \'China\', \'Columbia\', \'Cuba\', \'Dominican-Republic\',\n        \'Ecuador\', \'El-Salvador\', \'England\', \'France\', \'Germany\', \'Greece\',\n        \'Guatemala\', \'Haiti\', \'Holand-Netherlands\', \'Honduras\', \'Hong\',\n        \'Hungary\',\n        \'India\', \'Iran\', \'Ireland\', \'Italy\', \'Jamaica\', \'Japan\', \'Laos\',\n        \'Mexico\',\n        \'Nicaragua\', \'Outlying-US(Guam-USVI-etc)\', \'Peru\', \'Philippines\',\n        \'Poland\',\n        \'Portugal\', \'Puerto-Rico\', \'Scotland\', \'South\', \'Taiwan\', \'Thailand\',\n        \'Trinadad&Tobago\', \'United-States\', \'Vietnam\', \'Yugoslavia\'\n    ]),\n    \'income_bracket\': pd.api.types.CategoricalDtype(categories=[\n        \'<=50K\', \'>50K\'\n    ])\n}\n\n\ndef _download_and_clean_file(filename, url):\n    """Downloads data from url, and makes changes to match the CSV format.\n\n    The CSVs may use spaces after the comma delimters (non-standard) or include\n    rows which do not represent well-formed examples. This function strips out\n    some of these problems.\n\n    Args:\n      filename: filename to save url to\n      url: URL of resource to download\n    """\n    temp_file, _ = urllib.request.urlretrieve(url)\n    with tf.io.gfile.GFile(temp_file, \'r\') as temp_file_object:\n        with tf.io.gfile.GFile(filename, \'w\') as file_object:\n            for line in temp_file_object:\n                line = line.strip()\n                line = line.replace(\', \', \',\')\n                if not line or \',\' not in line:\n                    continue\n                if line[-1] == \'.\':\n                    line = line[:-1]\n                line += \'\\n\'\n                file_object.write(line)\n    tf.io.gfile.remove(temp_file)\n\n\ndef download(data_dir):\n    """Downloads census data if it is not already present.\n\n    Args:\n      data_dir: directory where we will access/save the census data\n    """\n    tf.io.gfile.makedirs(data_dir)\n\n    training_file_path = os.path.join(data_dir, TRAINING_FILE)\n    if not tf.io.gfile.exists(training_file_path):\n        _download_and_clean_file(training_file_path, TRAINING_URL)\n\n    eval_file_path = os.path.join(data_dir, EVAL_FILE)\n    if not tf.io.gfile.exists(eval_file_path):\n        _download_and_clean_file(eval_file_path, EVAL_URL)\n\n    return training_file_path, eval_file_path\n\n\ndef preprocess(dataframe):\n    """Converts categorical features to numeric. Removes unused columns.\n\n    Args:\n      dataframe: Pandas dataframe with raw data\n\n    Returns:\n      Dataframe with preprocessed data\n    """\n    dataframe = dataframe.drop(columns=UNUSED_COLUMNS)\n\n    # Convert integer valued (numeric) columns to floating point\n    numeric_columns = dataframe.select_dtypes([\'int64\']).columns\n    dataframe[numeric_columns] = dataframe[numeric_columns].astype(\'float32\')\n\n    # Convert categorical columns to numeric\n    cat_columns = dataframe.select_dtypes([\'object\']).columns\n    dataframe[cat_columns] = dataframe[cat_columns].apply(lambda x: x.astype(\n        _CATEGORICAL_TYPES[x.name]))\n    dataframe[cat_columns] = dataframe[cat_columns].apply(lambda x: x.cat.codes)\n    return dataframe\n\n\ndef standardize(dataframe):\n    """Scales numerical columns using their means and standard deviation to get\n    z-scores: the mean of each numerical column becomes 0, and the standard\n    deviation becomes 1. This can help the model converge during training.\n\n    Args:\n      dataframe: Pandas dataframe\n\n    Returns:\n      Input dataframe with the numerical columns scaled to z-scores\n    """\n    dtypes = list(zip(dataframe.dtypes.index, map(str, dataframe.dtypes)))\n    # Normalize numeric columns.\n    for column, dtype in dtypes:\n        if dtype == \'float32\':\n            dataframe[column] -= dataframe[column].mean()\n            dataframe[column] /= dataframe[column].std()\n    return dataframe\n\n\ndef load_data():\n    """Loads data into preprocessed (train_x, train_y, eval_y, eval_y)\n    dataframes.\n\n    Returns:\n      A tuple (train_x, train_y, eval_x, eval_y), where train_x and eval_x are\n      Pandas dataframes with features for training and train_y and eval_y are\n      numpy arrays with the corresponding labels.\n    """\n    # Download Census dataset: Training and eval csv files.\n    training_file_path, eval_file_path = download(DATA_DIR)\n\n    # This census data uses the value \'?\' for missing entries. We use\n    # na_values to\n    # find ? and set it to NaN.\n    # https://pandas.pydata.org/pandas-docs/stable/generated/pandas.read_csv\n    # .html\n    train_df = pd.read_csv(training_file_path, names=_CSV_COLUMNS,\n                           na_values=\'?\')\n    eval_df = pd.read_csv(eval_file_path, names=_CSV_COLUMNS, na_values=\'?\')\n\n    train_df = preprocess(train_df)\n    eval_df = preprocess(eval_df)\n\n    # Split train and eval data with labels. The pop method copies and removes\n    # the label column from the dataframe.\n    train_x, train_y = train_df, train_df.pop(_LABEL_COLUMN)\n    eval_x, eval_y = eval_df, eval_df.pop(_LABEL_COLUMN)\n\n    # Join train_x and eval_x to normalize on overall means and standard\n    # deviations. Then separate them again.\n    all_x = pd.concat([train_x, eval_x], keys=[\'train\', \'eval\'])\n    all_x = standardize(all_x)\n    train_x, eval_x = all_x.xs(\'train\'), all_x.xs(\'eval\')\n\n    # Reshape label columns for use with tf.data.Dataset\n    train_y = np.asarray(train_y).astype(\'float32\').reshape((-1, 1))\n    eval_y = np.asarray(eval_y).astype(\'float32\').reshape((-1, 1))\n\n    return train_x, train_y, eval_x, eval_y')
+get_ipython().run_cell_magic('writefile', 'trainer/util.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport json\nimport multiprocessing\nimport os\nimport re\nimport shutil\nimport tempfile\n\nimport numpy as np\nimport pandas as pd\nimport tensorflow as tf\n\nfrom . import fetch\nfrom . import metrics\n\n# Storage directory\nDATA_DIR = os.path.join(tempfile.gettempdir(), \'census_data\')\n\n# Download options.\nDATA_URL = (\n    \'https://storage.googleapis.com/cloud-samples-data/ai-platform/census\'\n    \'/data\')\nTRAINING_FILE = \'adult.data.csv\'\nEVAL_FILE = \'adult.test.csv\'\nTRAINING_URL = \'%s/%s\' % (DATA_URL, TRAINING_FILE)\nEVAL_URL = \'%s/%s\' % (DATA_URL, EVAL_FILE)\n\n# These are the features in the dataset.\n# Dataset information: https://archive.ics.uci.edu/ml/datasets/census+income\nCSV_COLUMNS = [\n    \'age\', \'workclass\', \'fnlwgt\', \'education\', \'education_num\',\n    \'marital_status\', \'occupation\', \'relationship\', \'race\', \'gender\',\n    \'capital_gain\', \'capital_loss\', \'hours_per_week\', \'native_country\',\n    \'income_bracket\'\n]\n\n# This is the label (target) we want to predict.\nLABEL_COLUMN = \'income_bracket\'\n\n# These are columns we will not use as features for training. There are many\n# reasons not to use certain attributes of data for training. Perhaps their\n# values are noisy or inconsistent, or perhaps they encode bias that we do not\n# want our model to learn. For a deep dive into the features of this Census\n# dataset and the challenges they pose, see the Introduction to ML Fairness\n# Notebook: https://colab.research.google.com/github/google/eng-edu/blob\n# /master/ml/cc/exercises/intro_to_fairness.ipynb\nUNUSED_COLUMNS = [\'fnlwgt\', \'education\', \'gender\']\n\n# These columns hold integer values in the CSV files. When reading in chunks\n# we pin their dtype up front, so that every chunk is parsed the same way no\n# matter which values happen to land in it.\n_NUMERIC_COLUMNS = [\n    \'age\', \'fnlwgt\', \'education_num\', \'capital_gain\', \'capital_loss\',\n    \'hours_per_week\'\n]\n\n# Column types to parse raw census data with, before preprocess().\nCSV_DTYPES = {column: (\'float32\' if column in _NUMERIC_COLUMNS else \'object\')\n              for column in CSV_COLUMNS}\n\n# Number of CSV rows held in memory at a time when streaming the data.\nCHUNK_SIZE = 100000\n\n# File, relative to an exported model, holding the statistics and\n# vocabularies its inputs were preprocessed with. SavedModel loaders ignore\n# the assets.extra directory.\nPREPROCESSING_FILE = os.path.join(\'assets.extra\', \'preprocessing.json\')\n\n# Number of bytes cleaned at a time by clean_file.\nCLEAN_BLOCK_SIZE = 1 << 22\n\n# Patterns used by clean_block to filter lines and strip trailing periods.\n_COMMA_RE = re.compile(\',\')\n_TRAILING_DOT_RE = re.compile(r\'\\.$\', re.MULTILINE)\n\nCATEGORICAL_TYPES = {\n    \'workclass\': pd.api.types.CategoricalDtype(categories=[\n        \'Federal-gov\', \'Local-gov\', \'Never-worked\', \'Private\', \'Self-emp-inc\',\n        \'Self-emp-not-inc\', \'State-gov\', \'Without-pay\'\n    ]),\n    \'marital_status\': pd.api.types.CategoricalDtype(categories=[\n        \'Divorced\', \'Married-AF-spouse\', \'Married-civ-spouse\',\n        \'Married-spouse-absent\', \'Never-married\', \'Separated\', \'Widowed\'\n    ]),\n    \'occupation\': pd.api.types.CategoricalDtype([\n        \'Adm-clerical\', \'Armed-Forces\', \'Craft-repair\', \'Exec-managerial\',\n        \'Farming-fishing\', \'Handlers-cleaners\', \'Machine-op-inspct\',\n        \'Other-service\', \'Priv-house-serv\', \'Prof-specialty\', \'Protective-serv\',\n        \'Sales\', \'Tech-support\', \'Transport-moving\'\n    ]),\n    \'relationship\': pd.api.types.CategoricalDtype(categories=[\n        \'Husband\', \'Not-in-family\', \'Other-relative\', \'Own-child\', \'Unmarried\',\n        \'Wife\'\n    ]),\n    \'race\': pd.api.types.CategoricalDtype(categories=[\n        \'Amer-Indian-Eskimo\', \'Asian-Pac-Islander\', \'Black\', \'Other\', \'White\'\n    ]),\n    \'native_country\': pd.api.types.CategoricalDtype(categories=[\n        \'Cambodia\', \'Canada\', \'China\', \'Columbia\', \'Cuba\', \'Dominican-Republic\',\n        \'Ecuador\', \'El-Salvador\', \'England\', \'France\', \'Germany\', \'Greece\',\n        \'Guatemala\', \'Haiti\', \'Holand-Netherlands\', \'Honduras\', \'Hong\',\n        \'Hungary\',\n        \'India\', \'Iran\', \'Ireland\', \'Italy\', \'Jamaica\', \'Japan\', \'Laos\',\n        \'Mexico\',\n        \'Nicaragua\', \'Outlying-US(Guam-USVI-etc)\', \'Peru\', \'Philippines\',\n        \'Poland\',\n        \'Portugal\', \'Puerto-Rico\', \'Scotland\', \'South\', \'Taiwan\', \'Thailand\',\n        \'Trinadad&Tobago\', \'United-States\', \'Vietnam\', \'Yugoslavia\'\n    ]),\n    \'income_bracket\': pd.api.types.CategoricalDtype(categories=[\n        \'<=50K\', \'>50K\'\n    ])\n}\n\n\ndef clean_block(text):\n    """Cleans a block of complete CSV lines.\n\n    Every line is stripped of surrounding whitespace and of spaces after the\n    comma delimiters, lines without any comma are dropped, and a trailing\n    period is removed. Rather than looping over the lines in Python, the rules\n    are applied with map() and filter() over C string methods, and with bulk\n    string and regular expression operations over the whole block.\n\n    Args:\n      text: string of one or more lines\n\n    Returns:\n      The cleaned lines, each terminated by a line break\n    """\n    # Reading a GFile line by line drops every carriage return, not only the\n    # ones in line breaks, so do the same here.\n    lines = text.replace(\'\\r\', \'\').split(\'\\n\')\n    text = \'\\n\'.join(filter(_COMMA_RE.search, map(str.strip, lines)))\n    if not text:\n        return \'\'\n    text = text.replace(\', \', \',\') + \'\\n\'\n    return _TRAILING_DOT_RE.sub(\'\', text)\n\n\ndef iter_blocks(file_object, end=None, block_size=CLEAN_BLOCK_SIZE):\n    """Reads a file in blocks that end on a line boundary.\n\n    Args:\n      file_object: file opened in binary mode, positioned at the start of a\n        line\n      end: optional offset to stop reading at; it must be a line boundary\n      block_size: approximate number of bytes per block\n\n    Yields:\n      Decoded strings made of complete lines.\n    """\n    position = file_object.tell()\n    remainder = b\'\'\n    while end is None or position < end:\n        size = block_size if end is None else min(block_size, end - position)\n        data = file_object.read(size)\n        if not data:\n            break\n        position += len(data)\n        data = remainder + data\n        split = data.rfind(b\'\\n\') + 1\n        remainder = data[split:]\n        if split:\n            yield data[:split].decode(\'utf-8\')\n    if remainder:\n        yield remainder.decode(\'utf-8\')\n\n\ndef _clean_range(args):\n    """Cleans the lines of a file between two line boundaries.\n\n    Args:\n      args: tuple (source, destination, start, end), where source is the path\n        of the raw file, destination the path to write the cleaned lines to,\n        and start and end the byte offsets to clean between\n    """\n    source, destination, start, end = args\n    with tf.io.gfile.GFile(source, \'rb\') as source_object:\n        source_object.seek(start)\n        with tf.io.gfile.GFile(destination, \'w\') as destination_object:\n            for block in iter_blocks(source_object, end):\n                destination_object.write(clean_block(block))\n\n\ndef split_offsets(source, num_parts):\n    """Splits a file into num_parts byte ranges on line boundaries.\n\n    Returns:\n      A list of (start, end) offsets covering the whole file.\n    """\n    size = tf.io.gfile.stat(source).length\n    offsets = [0]\n    with tf.io.gfile.GFile(source, \'rb\') as source_object:\n        for part in range(1, num_parts):\n            offset = max(size * part // num_parts, offsets[-1])\n            source_object.seek(offset)\n            # Move past the next line break. GFile.readline() can not be used\n            # to find it, since it drops carriage returns.\n            while offset < size:\n                data = source_object.read(1 << 16)\n                split = data.find(b\'\\n\')\n                if split >= 0:\n                    offset += split + 1\n                    break\n                offset += len(data)\n            if offset >= size:\n                break\n            offsets.append(offset)\n    offsets.append(size)\n    return [(start, end) for start, end in zip(offsets, offsets[1:])\n            if start < end]\n\n\ndef clean_file(source, destination, num_processes=1):\n    """Cleans a raw census CSV file.\n\n    The output is byte-identical to applying the rules of clean_block to each\n    line separately. With num_processes > 1, the file is split on line\n    boundaries and the parts are cleaned in parallel, then concatenated. The\n    worker processes are spawned and import TensorFlow, which takes a few\n    seconds, so this only pays off for large files.\n\n    Args:\n      source: path of the raw CSV file\n      destination: path to write the cleaned CSV file to\n      num_processes: number of processes to clean the file with\n    """\n    ranges = split_offsets(source, num_processes) if num_processes > 1 else []\n    if len(ranges) <= 1:\n        _clean_range((source, destination, 0, None))\n        return\n\n    temp_dir = tempfile.mkdtemp()\n    try:\n        tasks = [(source, os.path.join(temp_dir, \'part-%05d\' % i), start, end)\n                 for i, (start, end) in enumerate(ranges)]\n        # Forking is not safe once TensorFlow has been used, which it has\n        # been here through tf.io.gfile, so spawn the workers.\n        pool = multiprocessing.get_context(\'spawn\').Pool(len(tasks))\n        try:\n            pool.map(_clean_range, tasks)\n        finally:\n            pool.close()\n            pool.join()\n        with tf.io.gfile.GFile(destination, \'wb\') as destination_object:\n            for _, part, _, _ in tasks:\n                with tf.io.gfile.GFile(part, \'rb\') as part_object:\n                    shutil.copyfileobj(part_object, destination_object)\n    finally:\n        shutil.rmtree(temp_dir, ignore_errors=True)\n\n\ndef download(data_dir, data_url=DATA_URL):\n    """Downloads census data if it is not already present.\n\n    The training and eval files are downloaded concurrently, and cleaned with\n    clean_block while they stream in. The CSVs may use spaces after the comma\n    delimters (non-standard) or include rows which do not represent\n    well-formed examples, which the cleaning strips out. See fetch.fetch_all()\n    for how partial downloads are resumed and verified.\n\n    Args:\n      data_dir: directory where we will access/save the census data\n      data_url: base URL of the census data files\n    """\n    files = [(\'%s/%s\' % (data_url, name), name)\n             for name in (TRAINING_FILE, EVAL_FILE)]\n    training_file_path, eval_file_path = fetch.fetch_all(\n        files, data_dir, transform=clean_block)\n    return training_file_path, eval_file_path\n\n\ndef preprocess(dataframe, categorical_types=None):\n    """Converts categorical features to numeric. Removes unused columns.\n\n    Args:\n      dataframe: Pandas dataframe with raw data\n      categorical_types: optional dictionary mapping categorical columns to\n        Pandas CategoricalDtype, as returned by load_preprocessing(); defaults\n        to CATEGORICAL_TYPES\n\n    Returns:\n      Dataframe with preprocessed data\n    """\n    categorical_types = categorical_types or CATEGORICAL_TYPES\n    dataframe = dataframe.drop(columns=UNUSED_COLUMNS)\n\n    # Convert integer valued (numeric) columns to floating point\n    numeric_columns = dataframe.select_dtypes([\'int64\']).columns\n    dataframe[numeric_columns] = dataframe[numeric_columns].astype(\'float32\')\n\n    # Convert categorical columns to numeric\n    cat_columns = dataframe.select_dtypes([\'object\']).columns\n    dataframe[cat_columns] = dataframe[cat_columns].apply(lambda x: x.astype(\n        categorical_types[x.name]))\n    dataframe[cat_columns] = dataframe[cat_columns].apply(lambda x: x.cat.codes)\n    return dataframe\n\n\ndef compute_stats(dataframe):\n    """Computes the mean and standard deviation of the numerical columns.\n\n    Args:\n      dataframe: Pandas dataframe\n\n    Returns:\n      Dictionary mapping the name of each numerical (float32) column to a\n      (mean, std) pair\n    """\n    dtypes = list(zip(dataframe.dtypes.index, map(str, dataframe.dtypes)))\n    return {column: (dataframe[column].mean(), dataframe[column].std())\n            for column, dtype in dtypes if dtype == \'float32\'}\n\n\ndef standardize(dataframe, stats=None):\n    """Scales numerical columns using their means and standard deviation to get\n    z-scores: the mean of each numerical column becomes 0, and the standard\n    deviation becomes 1. This can help the model converge during training.\n\n    Args:\n      dataframe: Pandas dataframe\n      stats: optional dictionary mapping column names to (mean, std) pairs, as\n        returned by compute_stats(). If not given, the statistics are computed\n        from the dataframe itself.\n\n    Returns:\n      Input dataframe with the numerical columns scaled to z-scores\n    """\n    if stats is None:\n        stats = compute_stats(dataframe)\n    # Normalize numeric columns.\n    for column, (mean, std) in stats.items():\n        dataframe[column] -= mean\n        dataframe[column] /= std\n    return dataframe\n\n\nclass RunningStats(object):\n    """Running mean and variance of the numerical columns of a dataframe.\n\n    Chunks are merged one at a time with the pairwise update of Chan et al.,\n    so the statistics of a whole file can be computed in a single pass while\n    only one chunk is held in memory.\n    """\n\n    def __init__(self):\n        self.columns = None\n        self.count = 0\n        self.mean = None\n        self.m2 = None\n\n    @classmethod\n    def from_stats(cls, stats, count):\n        """Resumes from statistics computed over count rows.\n\n        Args:\n          stats: dictionary mapping column names to (mean, std) pairs, as\n            returned by as_dict()\n          count: number of rows the statistics were computed over\n\n        Returns:\n          A RunningStats that further chunks can be merged into\n        """\n        running_stats = cls()\n        running_stats.columns = list(stats)\n        running_stats.count = count\n        running_stats.mean = np.array([stats[column][0]\n                                       for column in running_stats.columns])\n        std = np.array([stats[column][1] for column in running_stats.columns])\n        running_stats.m2 = std ** 2 * (count - 1)\n        return running_stats\n\n    def update(self, dataframe):\n        """Merges the numerical (float32) columns of a dataframe chunk.\n\n        Args:\n          dataframe: Pandas dataframe, as returned by preprocess()\n        """\n        if self.columns is None:\n            self.columns = list(dataframe.select_dtypes([\'float32\']).columns)\n        values = dataframe[self.columns].values.astype(\'float64\')\n        count = values.shape[0]\n        if not count:\n            return\n        mean = values.mean(axis=0)\n        m2 = ((values - mean) ** 2).sum(axis=0)\n\n        if not self.count:\n            self.count, self.mean, self.m2 = count, mean, m2\n            return\n        total = self.count + count\n        delta = mean - self.mean\n        self.mean = self.mean + delta * count / total\n        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total\n        self.count = total\n\n    def as_dict(self):\n        """Returns a dictionary mapping column names to (mean, std) pairs.\n\n        The standard deviation uses the same unbiased estimator (ddof=1) as\n        Pandas, so the result can be passed to standardize().\n        """\n        std = np.sqrt(self.m2 / (self.count - 1))\n        return {column: (self.mean[i], std[i])\n                for i, column in enumerate(self.columns)}\n\n\ndef _read_csv_chunks(file_path, chunk_size, categorical_types=None):\n    """Reads and preprocesses a census CSV file in bounded chunks.\n\n    Args:\n      file_path: path of a cleaned census CSV file\n      chunk_size: number of rows per chunk\n      categorical_types: optional categorical types, as in preprocess()\n\n    Yields:\n      Tuples (features, labels) of preprocessed Pandas objects.\n    """\n    reader = pd.read_csv(file_path, names=CSV_COLUMNS, na_values=\'?\',\n                         dtype=CSV_DTYPES, chunksize=chunk_size)\n    for chunk in reader:\n        chunk = preprocess(chunk, categorical_types)\n        labels = chunk.pop(LABEL_COLUMN)\n        yield chunk, labels\n\n\ndef _sample_rows(file_path, size, chunk_size, categorical_types=None,\n                 seed=0):\n    """Draws a uniform random sample of the rows of a census CSV file.\n\n    The file is streamed in chunks. Every row gets a random key, and only\n    the size rows with the smallest keys seen so far are kept, so memory is\n    bounded by chunk_size + size rows whatever the size of the file.\n\n    Args:\n      file_path: path of a cleaned census CSV file\n      size: maximum number of rows to draw\n      chunk_size: number of rows to read at a time\n      categorical_types: optional categorical types, as in preprocess()\n      seed: seed of the random sample\n\n    Returns:\n      A tuple (features, labels) of preprocessed Pandas objects holding the\n      sampled rows in file order, or None if the file has no rows\n    """\n    random_state = np.random.RandomState(seed)\n    sample = None\n    for features, labels in _read_csv_chunks(file_path, chunk_size,\n                                             categorical_types):\n        keys = random_state.random_sample(len(features))\n        if sample is not None:\n            features = pd.concat([sample[0], features])\n            labels = pd.concat([sample[1], labels])\n            keys = np.concatenate([sample[2], keys])\n        keep = np.sort(np.argsort(keys, kind=\'stable\')[:size])\n        sample = features.iloc[keep], labels.iloc[keep], keys[keep]\n    if sample is None:\n        return None\n    return sample[0], sample[1]\n\n\ndef _scan_data(file_paths, chunk_size):\n    """Makes a single pass over census CSV files to compute their statistics.\n\n    Args:\n      file_paths: paths of cleaned census CSV files\n      chunk_size: number of rows per chunk\n\n    Returns:\n      A tuple (stats, counts, input_dim), where stats holds the (mean, std)\n      pairs of the numerical columns over all the files, as returned by\n      compute_stats(), and counts the number of rows of each file.\n    """\n    stats = RunningStats()\n    counts = []\n    for file_path in file_paths:\n        count = 0\n        for features, _ in _read_csv_chunks(file_path, chunk_size):\n            stats.update(features)\n            count += len(features)\n            input_dim = features.shape[1]\n        counts.append(count)\n    return stats.as_dict(), counts, input_dim\n\n\ndef load_data_streaming(chunk_size=CHUNK_SIZE, timings=None):\n    """Prepares the census data for streaming instead of loading it whole.\n\n    A first pass over the train and eval files computes the z-score\n    statistics with RunningStats. The returned generator functions make a\n    fresh pass over a file each time they are called and yield standardized\n    chunks, so peak memory depends on chunk_size rather than on file size.\n\n    Args:\n      chunk_size: number of CSV rows to hold in memory at a time\n      timings: optional dictionary to add the seconds spent downloading and\n        computing the statistics to, see metrics.timed()\n\n    Returns:\n      A tuple (train_chunks, eval_chunks, num_train_examples,\n      num_eval_examples, input_dim, stats), where train_chunks and\n      eval_chunks are functions returning a generator of (features, labels)\n      float32 numpy arrays, and stats holds the (mean, std) statistics used\n      to standardize the numerical columns.\n    """\n    with metrics.timed(timings, \'download\'):\n        training_file_path, eval_file_path = download(DATA_DIR)\n\n    # Normalize on overall means and standard deviations, like load_data().\n    with metrics.timed(timings, \'scan\'):\n        column_stats, counts, input_dim = _scan_data(\n            [training_file_path, eval_file_path], chunk_size)\n\n    def make_chunks(file_path):\n        def chunks():\n            for features, labels in _read_csv_chunks(file_path, chunk_size):\n                features = standardize(features, column_stats)\n                yield (features.values.astype(\'float32\'),\n                       np.asarray(labels).astype(\'float32\').reshape((-1, 1)))\n        return chunks\n\n    return (make_chunks(training_file_path), make_chunks(eval_file_path),\n            counts[0], counts[1], input_dim, column_stats)\n\n\ndef read_data(training_file_path, eval_file_path, timings=None):\n    """Reads and preprocesses the census CSV files.\n\n    Args:\n      training_file_path: path of the cleaned training CSV file\n      eval_file_path: path of the cleaned eval CSV file\n      timings: optional dictionary to add the seconds spent in the read_csv,\n        preprocess and standardize phases to, see metrics.timed()\n\n    Returns:\n      A tuple (train_x, train_y, eval_x, eval_y, stats), as returned by\n      load_data(), followed by the (mean, std) statistics used to standardize\n      the numerical columns.\n    """\n    # This census data uses the value \'?\' for missing entries. We use\n    # na_values to\n    # find ? and set it to NaN.\n    # https://pandas.pydata.org/pandas-docs/stable/generated/pandas.read_csv\n    # .html\n    with metrics.timed(timings, \'read_csv\'):\n        train_df = pd.read_csv(training_file_path, names=CSV_COLUMNS,\n                               na_values=\'?\')\n        eval_df = pd.read_csv(eval_file_path, names=CSV_COLUMNS,\n                              na_values=\'?\')\n\n    with metrics.timed(timings, \'preprocess\'):\n        train_df = preprocess(train_df)\n        eval_df = preprocess(eval_df)\n\n    # Split train and eval data with labels. The pop method copies and removes\n    # the label column from the dataframe.\n    train_x, train_y = train_df, train_df.pop(LABEL_COLUMN)\n    eval_x, eval_y = eval_df, eval_df.pop(LABEL_COLUMN)\n\n    # Join train_x and eval_x to normalize on overall means and standard\n    # deviations. Then separate them again.\n    with metrics.timed(timings, \'standardize\'):\n        all_x = pd.concat([train_x, eval_x], keys=[\'train\', \'eval\'])\n        stats = compute_stats(all_x)\n        all_x = standardize(all_x, stats)\n        train_x, eval_x = all_x.xs(\'train\'), all_x.xs(\'eval\')\n\n    # Reshape label columns for use with tf.data.Dataset\n    train_y = np.asarray(train_y).astype(\'float32\').reshape((-1, 1))\n    eval_y = np.asarray(eval_y).astype(\'float32\').reshape((-1, 1))\n\n    return train_x, train_y, eval_x, eval_y, stats\n\n\ndef load_data_incremental(new_file_paths, preprocessing, replay_size=0,\n                          chunk_size=CHUNK_SIZE, seed=0):\n    """Loads new census rows to fine-tune a previously trained model on.\n\n    The statistics saved with the previous model are updated with the new\n    rows only, using RunningStats, so the old data is not scanned again. The\n    new rows can be mixed with a random sample of the original training data,\n    to keep the model from forgetting it. The sample is drawn while streaming\n    the training file, so only chunk_size + replay_size of its rows are in\n    memory at once.\n\n    Args:\n      new_file_paths: paths of census CSV files with the new rows, raw or\n        cleaned\n      preprocessing: dictionary returned by load_preprocessing() for the\n        previous model\n      replay_size: number of rows of the original training data to add\n      chunk_size: number of rows of the training file to read at a time\n      seed: seed of the replay sample\n\n    Returns:\n      A tuple (train_x, train_y, eval_x, eval_y, stats, count) like\n      read_data(), where the training data is made of the new rows and the\n      replay sample, and count is the number of rows the updated stats\n      cover.\n    """\n    categorical_types = preprocessing[\'categorical_types\']\n\n    def read(file_path):\n        dataframe = pd.read_csv(file_path, names=CSV_COLUMNS, na_values=\'?\',\n                                dtype=CSV_DTYPES)\n        return preprocess(dataframe, categorical_types)\n\n    temp_dir = tempfile.mkdtemp()\n    try:\n        new_dfs = []\n        for i, file_path in enumerate(new_file_paths):\n            clean_path = os.path.join(temp_dir, \'new-%05d.csv\' % i)\n            clean_file(file_path, clean_path)\n            new_dfs.append(read(clean_path))\n    finally:\n        shutil.rmtree(temp_dir, ignore_errors=True)\n    train_df = pd.concat(new_dfs, ignore_index=True)\n    train_x, train_y = train_df, train_df.pop(LABEL_COLUMN)\n\n    # Merge the new rows into the saved statistics.\n    running_stats = RunningStats.from_stats(preprocessing[\'stats\'],\n                                            preprocessing[\'count\'])\n    running_stats.update(train_x)\n    stats = running_stats.as_dict()\n\n    training_file_path, eval_file_path = download(DATA_DIR)\n    if replay_size:\n        replay = _sample_rows(training_file_path, replay_size, chunk_size,\n                              categorical_types, seed)\n        if replay is not None:\n            train_x = pd.concat([train_x, replay[0]], ignore_index=True)\n            train_y = pd.concat([train_y, replay[1]], ignore_index=True)\n    eval_df = read(eval_file_path)\n    eval_x, eval_y = eval_df, eval_df.pop(LABEL_COLUMN)\n    train_x = standardize(train_x, stats)\n    eval_x = standardize(eval_x, stats)\n\n    # Reshape label columns for use with tf.data.Dataset\n    train_y = np.asarray(train_y).astype(\'float32\').reshape((-1, 1))\n    eval_y = np.asarray(eval_y).astype(\'float32\').reshape((-1, 1))\n\n    return train_x, train_y, eval_x, eval_y, stats, running_stats.count\n\n\ndef load_data():\n    """Loads data into preprocessed (train_x, train_y, eval_y, eval_y)\n    dataframes.\n\n    Returns:\n      A tuple (train_x, train_y, eval_x, eval_y), where train_x and eval_x are\n      Pandas dataframes with features for training and train_y and eval_y are\n      numpy arrays with the corresponding labels.\n    """\n    # Download Census dataset: Training and eval csv files.\n    training_file_path, eval_file_path = download(DATA_DIR)\n\n    train_x, train_y, eval_x, eval_y, _ = read_data(training_file_path,\n                                                    eval_file_path)\n    return train_x, train_y, eval_x, eval_y\n\n\ndef _preprocessing(stats, count):\n    """Describes the preprocessing of the data as a JSON-serializable dict."""\n    return {\n        \'columns\': [column for column in CSV_COLUMNS\n                    if column not in UNUSED_COLUMNS + [LABEL_COLUMN]],\n        \'count\': int(count),\n        \'stats\': {column: [float(mean), float(std)]\n                  for column, (mean, std) in stats.items()},\n        \'vocabularies\': {\n            column: {category: code for code, category in enumerate(\n                dtype.categories)}\n            for column, dtype in CATEGORICAL_TYPES.items()},\n    }\n\n\ndef save_preprocessing(model_dir, stats, count):\n    """Saves what scoring needs to preprocess inputs like the training data.\n\n    The file holds the (mean, std) statistics of the numerical columns, the\n    number of rows they were computed over, and the code of every category\n    of the categorical columns. It is written atomically to\n    PREPROCESSING_FILE under the exported model.\n\n    Args:\n      model_dir: directory of the exported model\n      stats: dictionary mapping numerical columns to (mean, std) pairs\n      count: number of rows the statistics were computed over\n    """\n    file_path = os.path.join(model_dir, PREPROCESSING_FILE)\n    tf.io.gfile.makedirs(os.path.dirname(file_path))\n    with tf.io.gfile.GFile(file_path + \'.tmp\', \'w\') as file_object:\n        json.dump(_preprocessing(stats, count), file_object, indent=2,\n                  sort_keys=True)\n    tf.io.gfile.rename(file_path + \'.tmp\', file_path, overwrite=True)\n\n\ndef load_preprocessing(model_dir):\n    """Loads the preprocessing saved with an exported model.\n\n    Models exported before the preprocessing was saved with them fall back to\n    a pass over the census data, which gives the statistics they were trained\n    with as long as the data has not changed since.\n\n    Args:\n      model_dir: directory of the exported model\n\n    Returns:\n      A dictionary with the feature \'columns\' in model input order, the row\n      \'count\', the (mean, std) \'stats\' and the \'vocabularies\' mapping\n      categories to codes as saved by save_preprocessing(), and\n      \'categorical_types\' mapping categorical columns to Pandas\n      CategoricalDtype for preprocess()\n    """\n    file_path = os.path.join(model_dir, PREPROCESSING_FILE)\n    if tf.io.gfile.exists(file_path):\n        with tf.io.gfile.GFile(file_path, \'r\') as file_object:\n            preprocessing = json.load(file_object)\n    else:\n        tf.compat.v1.logging.warn(\n            \'No %s in %s, computing the statistics from the census data\',\n            PREPROCESSING_FILE, model_dir)\n        stats, counts, _ = _scan_data(download(DATA_DIR), CHUNK_SIZE)\n        preprocessing = _preprocessing(stats, sum(counts))\n\n    preprocessing[\'stats\'] = {column: tuple(mean_std) for column, mean_std\n                              in preprocessing[\'stats\'].items()}\n    preprocessing[\'categorical_types\'] = {\n        column: pd.api.types.CategoricalDtype(\n            categories=sorted(vocabulary, key=vocabulary.get))\n        for column, vocabulary in preprocessing[\'vocabularies\'].items()}\n    return preprocessing')
+
+
+# util.py downloads the data files with the helpers in fetch.py. The files are fetched concurrently in HTTP range requests, cleaned while they stream in, and only moved into place once complete. An interrupted download resumes from where it stopped, and a `manifest.json` in the data directory records the checksum and size of every file, so that a partially written file is never mistaken for a complete one.
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('writefile', 'trainer/fetch.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nfrom concurrent import futures\nimport hashlib\nimport json\nimport os\nimport threading\n\nfrom six.moves import urllib\nimport tensorflow as tf\n\n# Number of bytes requested per HTTP range request. Every completed range is\n# flushed to the partial download, which is where an interrupted download\n# resumes from.\nRANGE_SIZE = 1 << 23\n\n# Number of bytes read from a response at a time.\n_READ_SIZE = 1 << 16\n\n# Number of files downloaded concurrently.\nNUM_WORKERS = 4\n\n# Seconds to wait for the server before giving up on a request.\n_TIMEOUT = 60\n\nMANIFEST_FILE = \'manifest.json\'\n\n_manifest_lock = threading.Lock()\n\n\ndef _read_manifest(manifest_path):\n    if not tf.io.gfile.exists(manifest_path):\n        return {}\n    with tf.io.gfile.GFile(manifest_path, \'r\') as manifest_file:\n        return json.load(manifest_file)\n\n\ndef _update_manifest(manifest_path, name, entry):\n    """Atomically records the manifest entry of a downloaded file."""\n    with _manifest_lock:\n        manifest = _read_manifest(manifest_path)\n        manifest[name] = entry\n        temp_path = manifest_path + \'.tmp\'\n        with tf.io.gfile.GFile(temp_path, \'w\') as manifest_file:\n            json.dump(manifest, manifest_file, indent=2, sort_keys=True)\n        tf.io.gfile.rename(temp_path, manifest_path, overwrite=True)\n\n\nclass _LineWriter(object):\n    """Writes data through a line-based transformation as it arrives.\n\n    Incoming bytes are buffered up to the last complete line, so that the\n    transformation only ever sees whole lines.\n    """\n\n    def __init__(self, file_object, transform):\n        self._file_object = file_object\n        self._transform = transform\n        self._remainder = b\'\'\n\n    def write(self, data):\n        data = self._remainder + data\n        split = data.rfind(b\'\\n\') + 1\n        self._remainder = data[split:]\n        if split:\n            self._file_object.write(\n                self._transform(data[:split].decode(\'utf-8\')))\n\n    def close(self):\n        if self._remainder:\n            self._file_object.write(\n                self._transform(self._remainder.decode(\'utf-8\')))\n            self._remainder = b\'\'\n\n\ndef _content_length(url):\n    """Returns the size of a resource if the server supports range requests.\n\n    Returns:\n      The size in bytes, or None if it is unknown or the server does not\n      accept range requests.\n    """\n    request = urllib.request.Request(url, method=\'HEAD\')\n    response = urllib.request.urlopen(request, timeout=_TIMEOUT)\n    try:\n        length = response.headers.get(\'Content-Length\')\n        if response.headers.get(\'Accept-Ranges\') != \'bytes\' or length is None:\n            return None\n        return int(length)\n    finally:\n        response.close()\n\n\ndef _copy_response(response, sinks):\n    """Copies a response body to every sink and returns its length."""\n    copied = 0\n    while True:\n        data = response.read(_READ_SIZE)\n        if not data:\n            return copied\n        for sink in sinks:\n            sink(data)\n        copied += len(data)\n\n\ndef fetch(url, destination, sha256=None, transform=None):\n    """Downloads a file with resume, checksum verification and atomic writes.\n\n    The raw bytes are downloaded in range requests of RANGE_SIZE to\n    destination + \'.part\', which an interrupted download resumes from. As the\n    bytes arrive they are hashed and passed through transform, so the output\n    is ready as soon as the last range is received. The output is written to\n    a temporary file and only renamed to destination once the download is\n    complete and its checksum verified, so destination never holds a partial\n    file.\n\n    Args:\n      url: URL of resource to download\n      destination: path to save the (transformed) resource to\n      sha256: optional expected SHA-256 hex digest of the raw resource\n      transform: optional function applied to blocks of complete lines, e.g.\n        a CSV cleaning function; the lines are written unchanged if omitted\n\n    Returns:\n      A dictionary describing the raw resource and the written file, as\n      recorded in the manifest\n\n    Raises:\n      ValueError: if the checksum of the downloaded resource does not match\n    """\n    part_path = destination + \'.part\'\n    temp_path = destination + \'.tmp\'\n    size = _content_length(url)\n    if size is None or not tf.io.gfile.exists(part_path):\n        offset = 0\n    else:\n        offset = tf.io.gfile.stat(part_path).length\n        if offset > size:\n            # The resource changed since the partial download started.\n            offset = 0\n\n    raw_sha = hashlib.sha256()\n    with tf.io.gfile.GFile(temp_path, \'wb\') as temp_object:\n        writer = _LineWriter(temp_object, transform or (lambda text: text))\n        sinks = [raw_sha.update, writer.write]\n\n        # Transform what was downloaded by a previous, interrupted run.\n        if offset:\n            with tf.io.gfile.GFile(part_path, \'rb\') as part_object:\n                _copy_response(part_object, sinks)\n\n        with tf.io.gfile.GFile(part_path, \'ab\' if offset else \'wb\') as part:\n            sinks.append(part.write)\n            if size is None:\n                response = urllib.request.urlopen(url, timeout=_TIMEOUT)\n                try:\n                    _copy_response(response, sinks)\n                finally:\n                    response.close()\n            while size is not None and offset < size:\n                end = min(offset + RANGE_SIZE, size) - 1\n                request = urllib.request.Request(\n                    url, headers={\'Range\': \'bytes=%d-%d\' % (offset, end)})\n                response = urllib.request.urlopen(request, timeout=_TIMEOUT)\n                try:\n                    if response.status != 206:\n                        raise IOError(\'Server ignored the range request for \'\n                                      \'%s\' % url)\n                    offset += _copy_response(response, sinks)\n                finally:\n                    response.close()\n                part.flush()\n        writer.close()\n\n    digest = raw_sha.hexdigest()\n    if sha256 is not None and digest != sha256:\n        tf.io.gfile.remove(part_path)\n        tf.io.gfile.remove(temp_path)\n        raise ValueError(\'Checksum mismatch for %s: expected %s, got %s\' %\n                         (url, sha256, digest))\n\n    tf.io.gfile.rename(temp_path, destination, overwrite=True)\n    tf.io.gfile.remove(part_path)\n    return {\n        \'url\': url,\n        \'sha256\': digest,\n        \'file_size\': tf.io.gfile.stat(destination).length,\n    }\n\n\ndef _is_complete(destination, entry):\n    """Checks that a file was fully written by fetch()."""\n    return (entry is not None and tf.io.gfile.exists(destination) and\n            tf.io.gfile.stat(destination).length == entry.get(\'file_size\'))\n\n\ndef fetch_all(files, data_dir, transform=None, num_workers=NUM_WORKERS):\n    """Downloads files concurrently unless they are already present.\n\n    A file counts as present only if it is recorded in the manifest of\n    data_dir and has the recorded size. The manifest also pins the checksum\n    of each raw resource: once a file has been downloaded, any later download\n    of the same name must have the same content. To pin a checksum up front,\n    add an entry {"sha256": ...} for the file name to the manifest.\n\n    Args:\n      files: list of (url, file name) pairs\n      data_dir: directory to save the files to\n      transform: optional function applied to blocks of complete lines, see\n        fetch()\n      num_workers: maximum number of files downloaded at the same time\n\n    Returns:\n      The list of paths of the files, in the order of files\n    """\n    tf.io.gfile.makedirs(data_dir)\n    manifest_path = os.path.join(data_dir, MANIFEST_FILE)\n    manifest = _read_manifest(manifest_path)\n\n    def fetch_file(url, name):\n        destination = os.path.join(data_dir, name)\n        entry = manifest.get(name)\n        if not _is_complete(destination, entry):\n            sha256 = entry.get(\'sha256\') if entry else None\n            _update_manifest(manifest_path, name,\n                             fetch(url, destination, sha256, transform))\n        return destination\n\n    with futures.ThreadPoolExecutor(max_workers=num_workers) as executor:\n        results = [executor.submit(fetch_file, url, name)\n                   for url, name in files]\n        return [result.result() for result in results]')
+
+
+# metrics.py instruments training: it times the phases of a job and records the throughput, step times and time spent waiting for input of every epoch, which task.py writes to metrics.json under the job directory.
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('writefile', 'trainer/metrics.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport collections\nimport contextlib\nimport json\nimport os\nimport time\n\nimport numpy as np\nimport tensorflow as tf\n\nMETRICS_FILE = \'metrics.json\'\n\n# A step is counted as input-bound when it spends more than this fraction of\n# its time waiting for its batch.\nINPUT_BOUND_FRACTION = 0.5\n\n\n@contextlib.contextmanager\ndef timed(timings, phase):\n    """Adds the seconds spent in a with block to timings[phase].\n\n    Args:\n      timings: dictionary of phase names to seconds, or None to not time\n      phase: name of the phase\n    """\n    start = time.time()\n    try:\n        yield\n    finally:\n        if timings is not None:\n            timings[phase] = timings.get(phase, 0.) + time.time() - start\n\n\ndef write_metrics(job_dir, metrics):\n    """Atomically writes a dictionary of metrics to METRICS_FILE."""\n    file_path = os.path.join(job_dir, METRICS_FILE)\n    tf.io.gfile.makedirs(job_dir)\n    with tf.io.gfile.GFile(file_path + \'.tmp\', \'w\') as file_object:\n        json.dump(metrics, file_object, indent=2, sort_keys=True)\n    tf.io.gfile.rename(file_path + \'.tmp\', file_path, overwrite=True)\n\n\nclass TrainingMetrics(tf.keras.callbacks.Callback):\n    """Records the throughput and step times of every training epoch.\n\n    Each step is timed from the start to the end of its batch. The very\n    first step, which also builds the graph, is left out of the step times.\n\n    When the training dataset goes through instrument(), the time each step\n    waits for its batch is measured too: the dataset records when every\n    batch leaves the input pipeline, and a step that starts before its batch\n    is ready waits for the difference. Steps that spend most of their time\n    waiting are counted as input-bound.\n\n    The callback can also trace a range of steps with the TensorFlow\n    profiler, for viewing in the Profile tab of TensorBoard.\n    """\n\n    def __init__(self, batch_size, logdir=None, profile_steps=None,\n                 input_bound_fraction=INPUT_BOUND_FRACTION, on_epoch=None):\n        """Initializes the callback.\n\n        Args:\n          batch_size: number of examples in each (global) batch\n          logdir: directory to write the profiler trace to\n          profile_steps: optional (first, last) pair of steps to trace,\n            counted from 1 across epochs\n          input_bound_fraction: fraction of its time a step must spend\n            waiting for its batch to be counted as input-bound\n          on_epoch: optional function called with the list of epoch records\n            at the end of every epoch\n        """\n        super(TrainingMetrics, self).__init__()\n        self.batch_size = batch_size\n        self.logdir = logdir\n        self.profile_steps = profile_steps\n        self.input_bound_fraction = input_bound_fraction\n        self.on_epoch = on_epoch\n        self.epochs = []\n        self._step = 0\n        self._first_step_time = None\n        self._profiling = False\n        self._instrumented = False\n        self._ready_times = collections.deque()\n\n    def instrument(self, dataset):\n        """Records when each batch of a training dataset is ready.\n\n        Args:\n          dataset: tf.data.Dataset of (features, labels) batches, to be\n            passed to fit() with steps_per_epoch so that a single iterator\n            goes through it\n\n        Returns:\n          The dataset, with a last stage recording the time every batch\n          comes out of the rest of the pipeline\n        """\n        self._instrumented = True\n\n        def mark(features, labels):\n            stamp = tf.numpy_function(self._mark, [], tf.int64)\n            with tf.control_dependencies([stamp]):\n                return tf.identity(features), tf.identity(labels)\n\n        return dataset.map(mark)\n\n    def _mark(self):\n        self._ready_times.append(time.time())\n        return np.int64(0)\n\n    def on_epoch_begin(self, epoch, logs=None):\n        self._epoch_start = time.time()\n        self._step_times = []\n        self._wait_times = []\n\n    def on_train_batch_begin(self, batch, logs=None):\n        self._step += 1\n        if self.profile_steps and self._step == self.profile_steps[0]:\n            tf.profiler.experimental.start(self.logdir)\n            self._profiling = True\n        self._step_start = time.time()\n\n    def on_train_batch_end(self, batch, logs=None):\n        # Batches are consumed in the order they were marked in. A batch\n        # marked before its step started was waiting in a prefetch buffer.\n        ready_time = (self._ready_times.popleft()\n                      if self._ready_times else None)\n        if self._step == 1:\n            self._first_step_time = time.time() - self._step_start\n        else:\n            self._step_times.append(time.time() - self._step_start)\n            if ready_time is not None:\n                self._wait_times.append(\n                    max(0., ready_time - self._step_start))\n        if self._profiling and self._step >= self.profile_steps[1]:\n            self._stop_profiling()\n\n    def on_epoch_end(self, epoch, logs=None):\n        step_times = np.array(self._step_times)\n        train_seconds = step_times.sum()\n        record = {\n            \'epoch\': epoch + 1,\n            \'seconds\': time.time() - self._epoch_start,\n            \'steps\': len(step_times),\n            \'train_seconds\': train_seconds,\n            \'examples_per_second\': (len(step_times) * self.batch_size /\n                                    train_seconds if train_seconds else 0.),\n        }\n        if not self.epochs and self._first_step_time is not None:\n            record[\'first_step_seconds\'] = self._first_step_time\n        if len(step_times):\n            p50, p90, p99 = np.percentile(step_times * 1000, [50, 90, 99])\n            record[\'step_time_ms\'] = {\'p50\': p50, \'p90\': p90, \'p99\': p99,\n                                      \'max\': step_times.max() * 1000}\n        if self._instrumented and len(self._wait_times) == len(step_times):\n            wait_times = np.array(self._wait_times)\n            input_bound = wait_times > self.input_bound_fraction * step_times\n            record.update(\n                input_wait_seconds=wait_times.sum(),\n                input_wait_fraction=(wait_times.sum() / train_seconds\n                                     if train_seconds else 0.),\n                input_bound_steps=int(input_bound.sum()))\n        record.update({name: float(value)\n                       for name, value in (logs or {}).items()})\n        self.epochs.append(record)\n        if self.on_epoch:\n            self.on_epoch(self.epochs)\n\n    def on_train_end(self, logs=None):\n        if self._profiling:\n            self._stop_profiling()\n\n    def _stop_profiling(self):\n        tf.profiler.experimental.stop()\n        self._profiling = False')
 
 
 # The second file, called model.py, defines the input function and the model architecture. In this example, we use tf.data API for the data pipeline and create the model using the Keras Sequential API. We define a DNN with an input layer and 3 additonal layers using the Relu activation function. Since the task is a binary classification, the output layer uses the sigmoid activation.
@@ -70,7 +86,7 @@ get_ipython().run_cell_magic('writefile', 'trainer/util.py', 'from __future__ im
 # In[7]:
 
 
-get_ipython().run_cell_magic('writefile', 'trainer/model.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport tensorflow as tf\n\n\ndef input_fn(features, labels, shuffle, num_epochs, batch_size):\n    """Generates an input function to be used for model training.\n\n    Args:\n      features: numpy array of features used for training or inference\n      labels: numpy array of labels for each example\n      shuffle: boolean for whether to shuffle the data or not (set True for\n        training, False for evaluation)\n      num_epochs: number of epochs to provide the data for\n      batch_size: batch size for training\n\n    Returns:\n      A tf.data.Dataset that can provide data to the Keras model for training or\n        evaluation\n    """\n    if labels is None:\n        inputs = features\n    else:\n        inputs = (features, labels)\n    dataset = tf.data.Dataset.from_tensor_slices(inputs)\n\n    if shuffle:\n        dataset = dataset.shuffle(buffer_size=len(features))\n\n    # We call repeat after shuffling, rather than before, to prevent separate\n    # epochs from blending together.\n    dataset = dataset.repeat(num_epochs)\n    dataset = dataset.batch(batch_size)\n    return dataset\n\n\ndef create_keras_model(input_dim, learning_rate):\n    """Creates Keras Model for Binary Classification.\n\n    The single output node + Sigmoid activation makes this a Logistic\n    Regression.\n\n    Args:\n      input_dim: How many features the input has\n      learning_rate: Learning rate for training\n\n    Returns:\n      The compiled Keras model (still needs to be trained)\n    """\n    Dense = tf.keras.layers.Dense\n    model = tf.keras.Sequential(\n        [\n            Dense(100, activation=tf.nn.relu, kernel_initializer=\'uniform\',\n                  input_shape=(input_dim,)),\n            Dense(75, activation=tf.nn.relu),\n            Dense(50, activation=tf.nn.relu),\n            Dense(25, activation=tf.nn.relu),\n            Dense(1, activation=tf.nn.sigmoid)\n        ])\n\n    # Custom Optimizer:\n    # https://www.tensorflow.org/api_docs/python/tf/train/RMSPropOptimizer\n    optimizer = tf.keras.optimizers.RMSprop(lr=learning_rate)\n\n    # Compile Keras model\n    model.compile(\n        loss=\'binary_crossentropy\', optimizer=optimizer, metrics=[\'accuracy\'])\n    return model')
+get_ipython().run_cell_magic('writefile', 'trainer/model.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport numpy as np\nimport tensorflow as tf\n\n\ndef _finish(dataset, fast, deterministic):\n    """Applies the options shared by the input functions.\n\n    Args:\n      dataset: batched tf.data.Dataset\n      fast: whether to prefetch batches in the background\n      deterministic: whether parallel stages must produce elements in order\n\n    Returns:\n      The dataset with prefetching and options applied\n    """\n    options = tf.data.Options()\n    options.experimental_deterministic = deterministic\n    # The data does not come from files, so when the dataset is distributed\n    # with tf.distribute, shard it by element across the workers.\n    options.experimental_distribute.auto_shard_policy = (\n        tf.data.experimental.AutoShardPolicy.DATA)\n    dataset = dataset.with_options(options)\n\n    if fast:\n        # Prepare the next batches while the model trains on the current one.\n        dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)\n    return dataset\n\n\ndef input_fn(features, labels, shuffle, num_epochs, batch_size,\n             shuffle_buffer_size=None, fast=False, deterministic=True):\n    """Generates an input function to be used for model training.\n\n    In fast mode, the pipeline shuffles and batches example indices instead\n    of the examples themselves, gathers each batch of examples in a parallel\n    map, and prefetches batches. Shuffling indices keeps the shuffle buffer\n    small even when it spans the whole dataset.\n\n    Args:\n      features: numpy array of features used for training or inference\n      labels: numpy array of labels for each example\n      shuffle: boolean for whether to shuffle the data or not (set True for\n        training, False for evaluation)\n      num_epochs: number of epochs to provide the data for\n      batch_size: batch size for training\n      shuffle_buffer_size: number of examples to shuffle between; defaults\n        to the whole dataset\n      fast: whether to use the fast pipeline described above\n      deterministic: whether the parallel map of the fast pipeline must keep\n        the order of the batches; disabling it trades reproducibility for\n        throughput\n\n    Returns:\n      A tf.data.Dataset that can provide data to the Keras model for training or\n        evaluation\n    """\n    if fast:\n        dataset = tf.data.Dataset.range(len(features))\n    elif labels is None:\n        dataset = tf.data.Dataset.from_tensor_slices(features)\n    else:\n        dataset = tf.data.Dataset.from_tensor_slices((features, labels))\n\n    if shuffle:\n        dataset = dataset.shuffle(\n            buffer_size=shuffle_buffer_size or len(features))\n\n    # We call repeat after shuffling, rather than before, to prevent separate\n    # epochs from blending together.\n    dataset = dataset.repeat(num_epochs)\n    dataset = dataset.batch(batch_size)\n\n    if fast:\n        features = tf.constant(features)\n        if labels is None:\n            gather = lambda indices: tf.gather(features, indices)\n        else:\n            labels = tf.constant(labels)\n            gather = lambda indices: (tf.gather(features, indices),\n                                      tf.gather(labels, indices))\n        dataset = dataset.map(\n            gather, num_parallel_calls=tf.data.experimental.AUTOTUNE)\n    return _finish(dataset, fast, deterministic)\n\n\ndef mapped_input_fn(features, labels, shuffle, num_epochs, batch_size,\n                    deterministic=True):\n    """Generates an input function that never copies the whole arrays.\n\n    Like the fast pipeline of input_fn, but every batch is gathered from the\n    numpy arrays by a Python function rather than from a constant tensor\n    holding a copy of them. Memory-mapped arrays, such as the ones sweep.py\n    shares between processes, thus stay shared.\n\n    Args:\n      features: numpy array of features used for training or inference\n      labels: numpy array of labels for each example\n      shuffle: boolean for whether to shuffle the data or not (set True for\n        training, False for evaluation)\n      num_epochs: number of epochs to provide the data for\n      batch_size: batch size for training\n      deterministic: whether the parallel map must keep the order of the\n        batches\n\n    Returns:\n      A tf.data.Dataset that can provide data to the Keras model for training or\n        evaluation\n    """\n    dataset = tf.data.Dataset.range(len(features))\n    if shuffle:\n        dataset = dataset.shuffle(buffer_size=len(features))\n    dataset = dataset.repeat(num_epochs)\n    dataset = dataset.batch(batch_size)\n\n    def gather(indices):\n        batch_features, batch_labels = tf.numpy_function(\n            lambda i: (np.take(features, i, axis=0),\n                       np.take(labels, i, axis=0)),\n            [indices], (tf.float32, tf.float32))\n        batch_features.set_shape([None, features.shape[1]])\n        batch_labels.set_shape([None, labels.shape[1]])\n        return batch_features, batch_labels\n\n    dataset = dataset.map(\n        gather, num_parallel_calls=tf.data.experimental.AUTOTUNE)\n    return _finish(dataset, True, deterministic)\n\n\ndef chunked_input_fn(chunks, input_dim, shuffle, num_epochs, batch_size,\n                     shuffle_buffer_size=10000, fast=False, cache_path=None,\n                     deterministic=True):\n    """Generates an input function that streams data from chunks.\n\n    Unlike input_fn, the data never has to fit in memory at once: only the\n    current chunk and the shuffle buffer are held at any time.\n\n    Args:\n      chunks: function returning a generator of (features, labels) numpy\n        arrays, such as the ones returned by util.load_data_streaming()\n      input_dim: How many features the input has\n      shuffle: boolean for whether to shuffle the data or not (set True for\n        training, False for evaluation)\n      num_epochs: number of epochs to provide the data for\n      batch_size: batch size for training\n      shuffle_buffer_size: number of examples to shuffle between, since the\n        data can not be shuffled as a whole\n      fast: whether to prefetch batches in the background\n      cache_path: optional file to cache the chunks in during the first\n        epoch, so that later epochs read them back instead of parsing the\n        CSV files again\n      deterministic: whether parallel stages must produce elements in order\n\n    Returns:\n      A tf.data.Dataset that can provide data to the Keras model for training or\n        evaluation\n    """\n    dataset = tf.data.Dataset.from_generator(\n        chunks,\n        output_types=(tf.float32, tf.float32),\n        output_shapes=(tf.TensorShape([None, input_dim]),\n                       tf.TensorShape([None, 1])))\n    if cache_path:\n        dataset = dataset.cache(cache_path)\n    dataset = dataset.unbatch()\n\n    if shuffle:\n        dataset = dataset.shuffle(buffer_size=shuffle_buffer_size)\n\n    # Without a cache, the generator is called again for every epoch, so\n    # each epoch makes a fresh pass over the files.\n    dataset = dataset.repeat(num_epochs)\n    dataset = dataset.batch(batch_size)\n    return _finish(dataset, fast, deterministic)\n\n\ndef create_keras_model(input_dim, learning_rate):\n    """Creates Keras Model for Binary Classification.\n\n    The single output node + Sigmoid activation makes this a Logistic\n    Regression.\n\n    Args:\n      input_dim: How many features the input has\n      learning_rate: Learning rate for training\n\n    Returns:\n      The compiled Keras model (still needs to be trained)\n    """\n    Dense = tf.keras.layers.Dense\n    model = tf.keras.Sequential(\n        [\n            Dense(100, activation=tf.nn.relu, kernel_initializer=\'uniform\',\n                  input_shape=(input_dim,)),\n            Dense(75, activation=tf.nn.relu),\n            Dense(50, activation=tf.nn.relu),\n            Dense(25, activation=tf.nn.relu),\n            Dense(1, activation=tf.nn.sigmoid)\n        ])\n\n    _compile(model, learning_rate)\n    return model\n\n\ndef load_keras_model(model_dir, learning_rate):\n    """Loads an exported Keras model to continue training it.\n\n    The model is compiled like create_keras_model() does, with a new optimizer\n    using learning_rate.\n\n    Args:\n      model_dir: path of the keras_export SavedModel written by task.py\n      learning_rate: Learning rate for training\n\n    Returns:\n      The compiled Keras model, with the weights of the exported one\n    """\n    model = tf.keras.models.load_model(model_dir, compile=False)\n    _compile(model, learning_rate)\n    return model\n\n\ndef _compile(model, learning_rate):\n    # Custom Optimizer:\n    # https://www.tensorflow.org/api_docs/python/tf/train/RMSPropOptimizer\n    optimizer = tf.keras.optimizers.RMSprop(lr=learning_rate)\n\n    # Compile Keras model\n    model.compile(\n        loss=\'binary_crossentropy\', optimizer=optimizer, metrics=[\'accuracy\'])')
 
 
 # The last file, called task.py, trains on data loaded and preprocessed in util.py. Using the tf.distribute.MirroredStrategy() scope, it is possible to train on a distributed fashion. The trained model is then saved in a TensorFlow SavedModel format.
@@ -78,7 +94,87 @@ get_ipython().run_cell_magic('writefile', 'trainer/model.py', 'from __future__ i
 # In[8]:
 
 
-get_ipython().run_cell_magic('writefile', 'trainer/task.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport argparse\nimport os\n\nfrom . import model\nfrom . import util\n\nimport tensorflow as tf\n\n\ndef get_args():\n    """Argument parser.\n\n    Returns:\n      Dictionary of arguments.\n    """\n    parser = argparse.ArgumentParser()\n    parser.add_argument(\n        \'--job-dir\',\n        type=str,\n        required=True,\n        help=\'local or GCS location for writing checkpoints and exporting \'\n             \'models\')\n    parser.add_argument(\n        \'--num-epochs\',\n        type=int,\n        default=20,\n        help=\'number of times to go through the data, default=20\')\n    parser.add_argument(\n        \'--batch-size\',\n        default=128,\n        type=int,\n        help=\'number of records to read during each training step, default=128\')\n    parser.add_argument(\n        \'--learning-rate\',\n        default=.01,\n        type=float,\n        help=\'learning rate for gradient descent, default=.01\')\n    parser.add_argument(\n        \'--verbosity\',\n        choices=[\'DEBUG\', \'ERROR\', \'FATAL\', \'INFO\', \'WARN\'],\n        default=\'INFO\')\n    args, _ = parser.parse_known_args()\n    return args\n\n\ndef train_and_evaluate(args):\n    """Trains and evaluates the Keras model.\n\n    Uses the Keras model defined in model.py and trains on data loaded and\n    preprocessed in util.py. Saves the trained model in TensorFlow SavedModel\n    format to the path defined in part by the --job-dir argument.\n\n    Args:\n      args: dictionary of arguments - see get_args() for details\n    """\n\n    train_x, train_y, eval_x, eval_y = util.load_data()\n\n    # dimensions\n    num_train_examples, input_dim = train_x.shape\n    num_eval_examples = eval_x.shape[0]\n\n    # Create the Keras Model\n    keras_model = model.create_keras_model(\n        input_dim=input_dim, learning_rate=args.learning_rate)\n\n    # Pass a numpy array by passing DataFrame.values\n    training_dataset = model.input_fn(\n        features=train_x.values,\n        labels=train_y,\n        shuffle=True,\n        num_epochs=args.num_epochs,\n        batch_size=args.batch_size)\n\n    # Pass a numpy array by passing DataFrame.values\n    validation_dataset = model.input_fn(\n        features=eval_x.values,\n        labels=eval_y,\n        shuffle=False,\n        num_epochs=args.num_epochs,\n        batch_size=num_eval_examples)\n\n    # Setup Learning Rate decay.\n    lr_decay_cb = tf.keras.callbacks.LearningRateScheduler(\n        lambda epoch: args.learning_rate + 0.02 * (0.5 ** (1 + epoch)),\n        verbose=True)\n\n    # Setup TensorBoard callback.\n    tensorboard_cb = tf.keras.callbacks.TensorBoard(\n        os.path.join(args.job_dir, \'keras_tensorboard\'),\n        histogram_freq=1)\n\n    # Train model\n    keras_model.fit(\n        training_dataset,\n        steps_per_epoch=int(num_train_examples / args.batch_size),\n        epochs=args.num_epochs,\n        validation_data=validation_dataset,\n        validation_steps=1,\n        verbose=1,\n        callbacks=[lr_decay_cb, tensorboard_cb])\n\n    export_path = os.path.join(args.job_dir, \'keras_export\')\n    tf.keras.models.save_model(keras_model, export_path)\n    print(\'Model exported to: {}\'.format(export_path))\n\n\n\nif __name__ == \'__main__\':\n    strategy = tf.distribute.MirroredStrategy()\n    with strategy.scope():\n        args = get_args()\n        tf.compat.v1.logging.set_verbosity(args.verbosity)\n        train_and_evaluate(args)')
+get_ipython().run_cell_magic('writefile', 'trainer/task.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport argparse\nimport json\nimport os\nimport shutil\nimport tempfile\n\nfrom . import cache\nfrom . import metrics\nfrom . import model\nfrom . import quantize\nfrom . import util\n\nimport tensorflow as tf\n\n# Directory, under the job directory, of the checkpoints saved every epoch.\nCHECKPOINT_DIR = \'checkpoints\'\n_CHECKPOINT_NAME = \'epoch-{epoch:03d}\'\n\n\ndef _step_range(value):\n    """Parses a FIRST,LAST pair of training steps."""\n    try:\n        first, last = [int(step) for step in value.split(\',\')]\n    except ValueError:\n        raise argparse.ArgumentTypeError(\'expected FIRST,LAST, got %r\' % value)\n    if not 0 < first <= last:\n        raise argparse.ArgumentTypeError(\'expected 0 < FIRST <= LAST\')\n    return first, last\n\n\ndef get_args():\n    """Argument parser.\n\n    Returns:\n      Dictionary of arguments.\n    """\n    parser = argparse.ArgumentParser()\n    parser.add_argument(\n        \'--job-dir\',\n        type=str,\n        required=True,\n        help=\'local or GCS location for writing checkpoints and exporting \'\n             \'models\')\n    parser.add_argument(\n        \'--num-epochs\',\n        type=int,\n        default=20,\n        help=\'number of times to go through the data, default=20\')\n    parser.add_argument(\n        \'--batch-size\',\n        default=128,\n        type=int,\n        help=\'number of records to read during each training step on each \'\n             \'replica, default=128\')\n    parser.add_argument(\n        \'--learning-rate\',\n        default=.01,\n        type=float,\n        help=\'learning rate for gradient descent, scaled by the number of \'\n             \'replicas, default=.01\')\n    parser.add_argument(\n        \'--distribution\',\n        choices=[\'auto\', \'mirrored\', \'multi-worker\'],\n        default=\'auto\',\n        help=\'mirrored: all devices of this machine; multi-worker: all \'\n             \'workers of the cluster in TF_CONFIG; auto: multi-worker if \'\n             \'TF_CONFIG describes more than one worker, default=auto\')\n    parser.add_argument(\n        \'--stream\',\n        action=\'store_true\',\n        help=\'stream the CSV files in chunks instead of loading them into \'\n             \'memory\')\n    parser.add_argument(\n        \'--chunk-size\',\n        default=util.CHUNK_SIZE,\n        type=int,\n        help=\'number of CSV rows to read at a time with --stream, or when \'\n             \'sampling --replay-size rows, default=%d\' % util.CHUNK_SIZE)\n    parser.add_argument(\n        \'--cache-dir\',\n        type=str,\n        help=\'local directory for caching the preprocessed data between runs, \'\n             \'disabled by default\')\n    parser.add_argument(\n        \'--cache-max-bytes\',\n        default=cache.CACHE_MAX_BYTES,\n        type=int,\n        help=\'maximum size of --cache-dir in bytes, default=%d\'\n             % cache.CACHE_MAX_BYTES)\n    parser.add_argument(\n        \'--input-pipeline\',\n        choices=[\'basic\', \'fast\'],\n        default=\'basic\',\n        help=\'basic: shuffle and batch the examples themselves; fast: \'\n             \'shuffle indices, gather batches in parallel and prefetch, \'\n             \'default=basic\')\n    parser.add_argument(\n        \'--shuffle-buffer-size\',\n        type=int,\n        help=\'number of examples to shuffle between, default=the whole \'\n             \'dataset, or --chunk-size with --stream\')\n    parser.add_argument(\n        \'--nondeterministic\',\n        action=\'store_true\',\n        help=\'let parallel input stages produce batches out of order for \'\n             \'higher throughput\')\n    parser.add_argument(\n        \'--dataset-cache\',\n        action=\'store_true\',\n        help=\'with --stream, cache the parsed data in a local temporary \'\n             \'directory during the first epoch instead of parsing the CSV \'\n             \'files every epoch\')\n    parser.add_argument(\n        \'--tflite-variants\',\n        choices=quantize.VARIANTS,\n        default=[],\n        nargs=\'+\',\n        help=\'also export TensorFlow Lite models with these precisions to \'\n             \'the tflite directory under --job-dir\')\n    parser.add_argument(\n        \'--calibration-size\',\n        default=quantize.CALIBRATION_SIZE,\n        type=int,\n        help=\'number of training rows to calibrate int8 quantization on, \'\n             \'default=%d\' % quantize.CALIBRATION_SIZE)\n    parser.add_argument(\n        \'--histogram-freq\',\n        default=0,\n        type=int,\n        help=\'epochs between weight histograms in TensorBoard; computing them \'\n             \'slows down training, default=0 (never)\')\n    parser.add_argument(\n        \'--profile-steps\',\n        type=_step_range,\n        metavar=\'FIRST,LAST\',\n        help=\'trace the training steps FIRST to LAST (counted from 1 across \'\n             \'epochs) with the TensorFlow profiler, for the Profile tab of \'\n             \'TensorBoard\')\n    parser.add_argument(\n        \'--warm-start-dir\',\n        type=str,\n        help=\'keras_export directory of a previous job to fine-tune instead \'\n             \'of training a new model; requires --new-data\')\n    parser.add_argument(\n        \'--new-data\',\n        type=str,\n        default=[],\n        nargs=\'+\',\n        help=\'local or GCS paths of census CSV files with the new rows to \'\n             \'fine-tune on with --warm-start-dir\')\n    parser.add_argument(\n        \'--replay-size\',\n        default=0,\n        type=int,\n        help=\'number of rows of the original training data to fine-tune on \'\n             \'along with --new-data, default=0\')\n    parser.add_argument(\n        \'--checkpoint\',\n        action=\'store_true\',\n        help=\'save a checkpoint under --job-dir at the end of every epoch, \'\n             \'and resume training from the latest one found there\')\n    parser.add_argument(\n        \'--verbosity\',\n        choices=[\'DEBUG\', \'ERROR\', \'FATAL\', \'INFO\', \'WARN\'],\n        default=\'INFO\')\n    args, _ = parser.parse_known_args()\n    if args.warm_start_dir:\n        if not args.new_data:\n            parser.error(\'--warm-start-dir requires --new-data\')\n        if args.stream or args.cache_dir:\n            parser.error(\'--warm-start-dir can not be combined with --stream \'\n                         \'or --cache-dir\')\n    return args\n\n\ndef learning_rate_schedule(learning_rate, num_replicas=1):\n    """Returns the learning rate decay of task.py as a function of the epoch.\n\n    The decay is scaled by the number of replicas like the base learning\n    rate.\n    """\n    return lambda epoch: num_replicas * (\n        learning_rate + 0.02 * (0.5 ** (1 + epoch)))\n\n\ndef _latest_checkpoint(checkpoint_dir):\n    """Finds the latest checkpoint saved by a previous attempt of the job.\n\n    Returns:\n      A tuple (path, epoch) of the checkpoint and the number of epochs it was\n      saved after, or (None, 0) if there is none\n    """\n    path = tf.train.latest_checkpoint(checkpoint_dir)\n    if path is None:\n        return None, 0\n    return path, int(os.path.basename(path).split(\'-\')[-1])\n\n\ndef _tf_config():\n    return json.loads(os.environ.get(\'TF_CONFIG\', \'{}\'))\n\n\ndef get_strategy(distribution):\n    """Creates the distribution strategy to train with.\n\n    Args:\n      distribution: \'mirrored\', \'multi-worker\', or \'auto\' to pick\n        \'multi-worker\' when TF_CONFIG describes more than one worker\n\n    Returns:\n      A tf.distribute.Strategy\n    """\n    if distribution == \'auto\':\n        cluster = _tf_config().get(\'cluster\', {})\n        num_workers = sum(len(cluster.get(task_type, []))\n                          for task_type in (\'chief\', \'master\', \'worker\'))\n        distribution = \'multi-worker\' if num_workers > 1 else \'mirrored\'\n    if distribution == \'multi-worker\':\n        return tf.distribute.MultiWorkerMirroredStrategy()\n    return tf.distribute.MirroredStrategy()\n\n\ndef is_chief_task():\n    """Checks whether this process writes the outputs of the job."""\n    tf_config = _tf_config()\n    task = tf_config.get(\'task\', {})\n    if task.get(\'type\') in (\'chief\', \'master\'):\n        return True\n    cluster = tf_config.get(\'cluster\', {})\n    if \'chief\' in cluster or \'master\' in cluster:\n        return False\n    return task.get(\'index\', 0) == 0\n\n\ndef train_and_evaluate(args):\n    """Trains and evaluates the Keras model.\n\n    Uses the Keras model defined in model.py and trains on data loaded and\n    preprocessed in util.py. Saves the trained model in TensorFlow SavedModel\n    format to the path defined in part by the --job-dir argument, along with\n    the statistics and vocabularies its inputs were preprocessed with (see\n    util.save_preprocessing()).\n\n    Training is data-parallel across the replicas of the strategy chosen by\n    --distribution: each step processes --batch-size examples on every\n    replica, and the learning rate is scaled linearly with the number of\n    replicas to match the larger global batch.\n\n    The time spent in each phase of the job, and the throughput, step time\n    percentiles and input wait of every epoch (see metrics.TrainingMetrics)\n    are written to metrics.json under --job-dir.\n\n    With --warm-start-dir, the model exported by a previous job is fine-tuned\n    on the rows of --new-data, plus --replay-size rows of the original\n    training data, at the constant --learning-rate. The statistics saved with\n    the previous model are updated with the new rows only (see\n    util.load_data_incremental()).\n\n    With --checkpoint, the weights and optimizer state are saved at the end\n    of every epoch, and a job restarted after an interruption resumes from\n    the last completed epoch instead of starting over.\n\n    Args:\n      args: dictionary of arguments - see get_args() for details\n    """\n    # The strategy must be created before any other TensorFlow operation.\n    strategy = get_strategy(args.distribution)\n    num_replicas = strategy.num_replicas_in_sync\n    batch_size = args.batch_size * num_replicas\n    learning_rate = args.learning_rate * num_replicas\n\n    # Seconds spent in each phase. load_data includes the phases nested in\n    # it: download, and read_csv, preprocess and standardize, or scan with\n    # --stream.\n    timings = {}\n    job_metrics = {\'phases\': timings, \'num_replicas\': num_replicas,\n                   \'batch_size\': batch_size}\n    with metrics.timed(timings, \'load_data\'):\n        if args.warm_start_dir:\n            (train_x, train_y, eval_x, eval_y, stats,\n             stats_count) = util.load_data_incremental(\n                 args.new_data, util.load_preprocessing(args.warm_start_dir),\n                 args.replay_size, args.chunk_size)\n            num_train_examples, input_dim = train_x.shape\n            num_eval_examples = eval_x.shape[0]\n        elif args.stream:\n            (train_chunks, eval_chunks, num_train_examples, num_eval_examples,\n             input_dim, stats) = util.load_data_streaming(args.chunk_size,\n                                                          timings)\n        else:\n            if args.cache_dir:\n                train_x, train_y, eval_x, eval_y, stats = cache.load_data(\n                    args.cache_dir, args.cache_max_bytes)\n            else:\n                with metrics.timed(timings, \'download\'):\n                    training_file_path, eval_file_path = util.download(\n                        util.DATA_DIR)\n                train_x, train_y, eval_x, eval_y, stats = util.read_data(\n                    training_file_path, eval_file_path, timings)\n\n            # dimensions\n            num_train_examples, input_dim = train_x.shape\n            num_eval_examples = eval_x.shape[0]\n        if not args.warm_start_dir:\n            # The statistics are computed over the train and eval data\n            # together.\n            stats_count = num_train_examples + num_eval_examples\n    job_metrics[\'num_train_examples\'] = int(num_train_examples)\n\n    # Every worker takes part in training and saving the model, but only the\n    # chief keeps its outputs.\n    is_chief = is_chief_task()\n    checkpoint_dir = os.path.join(args.job_dir, CHECKPOINT_DIR)\n    checkpoint_path, initial_epoch = (_latest_checkpoint(checkpoint_dir)\n                                      if args.checkpoint else (None, 0))\n\n    # Create the Keras Model. Its variables are mirrored on every replica.\n    with metrics.timed(timings, \'build_model\'), strategy.scope():\n        if args.warm_start_dir:\n            keras_model = model.load_keras_model(\n                args.warm_start_dir, learning_rate=learning_rate)\n        else:\n            keras_model = model.create_keras_model(\n                input_dim=input_dim, learning_rate=learning_rate)\n        if checkpoint_path:\n            keras_model.load_weights(checkpoint_path)\n            print(\'Resuming after epoch {} from: {}\'.format(\n                initial_epoch, checkpoint_path))\n    job_metrics[\'initial_epoch\'] = initial_epoch\n\n    fast = args.input_pipeline == \'fast\'\n    deterministic = not args.nondeterministic\n    dataset_cache_dir = None\n    if args.stream:\n        if args.dataset_cache:\n            # A new local directory for every process, so that workers, and\n            # restarts of an interrupted job, never share a partly written\n            # cache or read one written with other statistics.\n            dataset_cache_dir = tempfile.mkdtemp(prefix=\'dataset_cache\')\n            train_cache_path = os.path.join(dataset_cache_dir, \'train\')\n            eval_cache_path = os.path.join(dataset_cache_dir, \'eval\')\n        else:\n            train_cache_path = eval_cache_path = None\n\n        # By default, shuffle within one chunk\'s worth of examples, so memory\n        # stays bounded by --chunk-size.\n        training_dataset = model.chunked_input_fn(\n            chunks=train_chunks,\n            input_dim=input_dim,\n            shuffle=True,\n            num_epochs=args.num_epochs,\n            batch_size=batch_size,\n            shuffle_buffer_size=args.shuffle_buffer_size or args.chunk_size,\n            fast=fast,\n            cache_path=train_cache_path,\n            deterministic=deterministic)\n\n        # Evaluate in regular batches rather than in a single batch holding\n        # the whole eval file. The dataset is not repeated, so that every\n        # evaluation reads it exactly once, ending with a partial batch.\n        validation_dataset = model.chunked_input_fn(\n            chunks=eval_chunks,\n            input_dim=input_dim,\n            shuffle=False,\n            num_epochs=1,\n            batch_size=batch_size,\n            fast=fast,\n            cache_path=eval_cache_path,\n            deterministic=deterministic)\n        validation_steps = None\n    else:\n        # Pass a numpy array by passing DataFrame.values\n        training_dataset = model.input_fn(\n            features=train_x.values,\n            labels=train_y,\n            shuffle=True,\n            num_epochs=args.num_epochs,\n            batch_size=batch_size,\n            shuffle_buffer_size=args.shuffle_buffer_size,\n            fast=fast,\n            deterministic=deterministic)\n\n        # Pass a numpy array by passing DataFrame.values\n        validation_dataset = model.input_fn(\n            features=eval_x.values,\n            labels=eval_y,\n            shuffle=False,\n            num_epochs=args.num_epochs,\n            batch_size=num_eval_examples,\n            fast=fast,\n            deterministic=deterministic)\n        validation_steps = 1\n\n    # Setup Learning Rate decay, scaled like the base learning rate. The\n    # decay starts well above --learning-rate, which suits a new model but\n    # would undo much of a warm-started one.\n    if args.warm_start_dir:\n        schedule = lambda epoch: learning_rate\n    else:\n        schedule = learning_rate_schedule(args.learning_rate, num_replicas)\n    lr_decay_cb = tf.keras.callbacks.LearningRateScheduler(schedule,\n                                                           verbose=True)\n    callbacks = [lr_decay_cb]\n\n    if args.checkpoint:\n        # Workers other than the chief must save too, but to a throwaway\n        # directory.\n        save_dir = checkpoint_dir if is_chief else tempfile.mkdtemp()\n        checkpoint_cb = tf.keras.callbacks.ModelCheckpoint(\n            os.path.join(save_dir, _CHECKPOINT_NAME),\n            save_weights_only=True)\n        callbacks.append(checkpoint_cb)\n\n    tensorboard_dir = os.path.join(args.job_dir, \'keras_tensorboard\')\n\n    def on_epoch(epochs):\n        job_metrics[\'epochs\'] = epochs\n        metrics.write_metrics(args.job_dir, job_metrics)\n\n    metrics_cb = metrics.TrainingMetrics(\n        batch_size, logdir=tensorboard_dir,\n        profile_steps=args.profile_steps if is_chief else None,\n        on_epoch=on_epoch if is_chief else None)\n    callbacks.append(metrics_cb)\n    if is_chief:\n        # Setup TensorBoard callback. Its own profiling is disabled in favor\n        # of --profile-steps.\n        tensorboard_cb = tf.keras.callbacks.TensorBoard(\n            tensorboard_dir,\n            histogram_freq=args.histogram_freq,\n            profile_batch=0)\n        callbacks.append(tensorboard_cb)\n\n    # Split every global batch between the replicas, once metrics_cb has\n    # marked when it is ready. Keras distributes the validation dataset the\n    # same way itself, which unlike a distributed dataset does not need a\n    # number of validation steps.\n    training_dataset = strategy.experimental_distribute_dataset(\n        metrics_cb.instrument(training_dataset))\n\n    # Train model. Each step consumes one global batch across all replicas.\n    try:\n        with metrics.timed(timings, \'train\'):\n            keras_model.fit(\n                training_dataset,\n                steps_per_epoch=int(num_train_examples / batch_size),\n                epochs=args.num_epochs,\n                initial_epoch=initial_epoch,\n                validation_data=validation_dataset,\n                validation_steps=validation_steps,\n                verbose=1,\n                callbacks=callbacks)\n    finally:\n        if dataset_cache_dir:\n            shutil.rmtree(dataset_cache_dir, ignore_errors=True)\n\n    if is_chief:\n        export_path = os.path.join(args.job_dir, \'keras_export\')\n    else:\n        export_path = tempfile.mkdtemp()\n    with metrics.timed(timings, \'export\'):\n        tf.keras.models.save_model(keras_model, export_path)\n    if is_chief:\n        util.save_preprocessing(export_path, stats, stats_count)\n        print(\'Model exported to: {}\'.format(export_path))\n        if args.tflite_variants:\n            with metrics.timed(timings, \'export_tflite\'):\n                if args.stream:\n                    # Calibrate on the first chunk of the training data.\n                    train_features = next(iter(train_chunks()))[0]\n                else:\n                    train_features = train_x.values\n                tflite_paths = quantize.export(\n                    export_path, os.path.join(args.job_dir,\n                                              quantize.TFLITE_DIR),\n                    args.tflite_variants,\n                    quantize.sample_rows(train_features,\n                                         args.calibration_size))\n            for variant, path in sorted(tflite_paths.items()):\n                print(\'{} model exported to: {}\'.format(variant, path))\n        job_metrics[\'epochs\'] = metrics_cb.epochs\n        metrics.write_metrics(args.job_dir, job_metrics)\n    else:\n        shutil.rmtree(export_path, ignore_errors=True)\n        if args.checkpoint:\n            shutil.rmtree(save_dir, ignore_errors=True)\n\n\nif __name__ == \'__main__\':\n    args = get_args()\n    tf.compat.v1.logging.set_verbosity(args.verbosity)\n    train_and_evaluate(args)')
+
+
+# Parsing and preprocessing the CSV files is repeated on every training run, even when neither the data nor the preprocessing has changed. The optional cache.py stores the preprocessed float32 features, labels and normalization statistics as `.npy` files keyed by a hash of the source files and of the preprocessing configuration in util.py. Later runs memory-map the arrays instead of parsing the CSV files again. Enable it by passing `--cache-dir` to task.py; the least recently used entries are evicted once the directory grows beyond `--cache-max-bytes`.
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('writefile', 'trainer/cache.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport hashlib\nimport json\nimport os\nimport shutil\nimport tempfile\n\nimport numpy as np\nimport pandas as pd\nimport tensorflow as tf\n\nfrom . import util\n\n# Default cache location and size limit.\nCACHE_DIR = os.path.join(util.DATA_DIR, \'feature_cache\')\nCACHE_MAX_BYTES = 2 ** 30\n\n# Version of the on-disk layout. Bump it whenever the files written by\n# write_entry() change, so that old entries are no longer picked up.\n_CACHE_VERSION = 1\n\n# Files making up one cache entry.\n_ARRAYS = [\'train_x\', \'train_y\', \'eval_x\', \'eval_y\']\n_META_FILE = \'meta.json\'\n\n# Block size used when hashing the source files.\n_HASH_BLOCK_SIZE = 1 << 20\n\n\ndef cache_key(file_paths):\n    """Computes the cache key of the preprocessed data.\n\n    The key changes whenever the contents of a source file or the\n    preprocessing configuration in util.py (columns, unused columns and\n    categorical vocabularies) change.\n\n    Args:\n      file_paths: paths of the cleaned CSV files the data is read from\n\n    Returns:\n      Hex digest identifying the preprocessed data\n    """\n    sha = hashlib.sha256()\n    config = {\n        \'version\': _CACHE_VERSION,\n        \'csv_columns\': util.CSV_COLUMNS,\n        \'unused_columns\': util.UNUSED_COLUMNS,\n        \'categories\': {\n            column: [str(category) for category in dtype.categories]\n            for column, dtype in sorted(util.CATEGORICAL_TYPES.items())\n        },\n    }\n    sha.update(json.dumps(config, sort_keys=True).encode(\'utf-8\'))\n    for file_path in file_paths:\n        with tf.io.gfile.GFile(file_path, \'rb\') as file_object:\n            while True:\n                block = file_object.read(_HASH_BLOCK_SIZE)\n                if not block:\n                    break\n                sha.update(block)\n    return sha.hexdigest()\n\n\ndef _entry_size(entry_dir):\n    """Returns the size in bytes of the files in a cache entry."""\n    return sum(os.path.getsize(os.path.join(entry_dir, name))\n               for name in os.listdir(entry_dir))\n\n\ndef write_entry(entry_dir, train_x, train_y, eval_x, eval_y, stats):\n    """Writes a cache entry atomically.\n\n    The files are written to a temporary directory next to the entry, which is\n    then renamed into place, so a concurrent or interrupted run never sees a\n    partial entry.\n    """\n    cache_dir = os.path.dirname(entry_dir)\n    temp_dir = tempfile.mkdtemp(dir=cache_dir, prefix=\'.tmp-\')\n    try:\n        arrays = {\n            \'train_x\': train_x.values.astype(\'float32\'),\n            \'train_y\': train_y,\n            \'eval_x\': eval_x.values.astype(\'float32\'),\n            \'eval_y\': eval_y,\n        }\n        for name in _ARRAYS:\n            np.save(os.path.join(temp_dir, name + \'.npy\'), arrays[name])\n        meta = {\n            \'columns\': list(train_x.columns),\n            \'stats\': {column: [float(mean), float(std)]\n                      for column, (mean, std) in stats.items()},\n        }\n        with open(os.path.join(temp_dir, _META_FILE), \'w\') as meta_file:\n            json.dump(meta, meta_file)\n        os.rename(temp_dir, entry_dir)\n    except OSError:\n        # Another process stored the same entry first.\n        shutil.rmtree(temp_dir, ignore_errors=True)\n        if not os.path.exists(entry_dir):\n            raise\n\n\ndef read_entry(entry_dir):\n    """Memory-maps a cache entry.\n\n    Returns:\n      A tuple (train_x, train_y, eval_x, eval_y, stats) like\n      util.read_data(), where the features are dataframes backed by read-only\n      memory-mapped arrays.\n    """\n    with open(os.path.join(entry_dir, _META_FILE)) as meta_file:\n        meta = json.load(meta_file)\n    arrays = {name: np.load(os.path.join(entry_dir, name + \'.npy\'),\n                            mmap_mode=\'r\')\n              for name in _ARRAYS}\n    # Wrapping a 2D array of a single dtype does not copy it.\n    train_x = pd.DataFrame(arrays[\'train_x\'], columns=meta[\'columns\'],\n                           copy=False)\n    eval_x = pd.DataFrame(arrays[\'eval_x\'], columns=meta[\'columns\'],\n                          copy=False)\n    stats = {column: tuple(mean_std)\n             for column, mean_std in meta[\'stats\'].items()}\n    return train_x, arrays[\'train_y\'], eval_x, arrays[\'eval_y\'], stats\n\n\ndef evict(cache_dir, max_bytes, keep=None):\n    """Removes least recently used entries until the cache fits in max_bytes.\n\n    Args:\n      cache_dir: directory holding the cache entries\n      max_bytes: maximum total size of the cache in bytes\n      keep: optional name of an entry that must not be evicted\n    """\n    entries = []\n    for name in os.listdir(cache_dir):\n        entry_dir = os.path.join(cache_dir, name)\n        meta_path = os.path.join(entry_dir, _META_FILE)\n        if name.startswith(\'.\') or not os.path.exists(meta_path):\n            continue\n        entries.append((os.path.getmtime(meta_path), name,\n                        _entry_size(entry_dir)))\n\n    total = sum(size for _, _, size in entries)\n    for _, name, size in sorted(entries):\n        if total <= max_bytes:\n            break\n        if name == keep:\n            continue\n        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)\n        total -= size\n\n\ndef load_data(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):\n    """Loads the preprocessed data through the on-disk feature cache.\n\n    On a cache hit the float32 feature matrices and labels are memory-mapped\n    instead of parsing and preprocessing the CSV files again. On a miss the\n    data is loaded with util.read_data() and stored for the next run. The\n    cache directory must be on a local file system.\n\n    Args:\n      cache_dir: directory holding the cache entries\n      max_bytes: maximum total size of the cache in bytes; least recently\n        used entries are evicted beyond that\n\n    Returns:\n      A tuple (train_x, train_y, eval_x, eval_y, stats) like\n      util.read_data()\n    """\n    training_file_path, eval_file_path = util.download(util.DATA_DIR)\n\n    key = cache_key([training_file_path, eval_file_path])\n    entry_dir = os.path.join(cache_dir, key)\n    if os.path.exists(os.path.join(entry_dir, _META_FILE)):\n        # Mark the entry as recently used for eviction.\n        os.utime(os.path.join(entry_dir, _META_FILE), None)\n        return read_entry(entry_dir)\n\n    train_x, train_y, eval_x, eval_y, stats = util.read_data(\n        training_file_path, eval_file_path)\n    if not os.path.exists(cache_dir):\n        os.makedirs(cache_dir)\n    write_entry(entry_dir, train_x, train_y, eval_x, eval_y, stats)\n    evict(cache_dir, max_bytes, keep=key)\n    # Read the entry back, so that hits and misses return the same arrays.\n    return read_entry(entry_dir)')
+
+
+# Finally, predict.py scores large files offline with the exported model. It loads the SavedModel once, reads census-format CSV or JSONL rows in blocks of a few megabytes, preprocesses and standardizes each block as a whole with the same util.py code and the same statistics and vocabularies used for training, scores it in batches of `--batch-size` rows, and streams the predictions to the output file. Every prediction is keyed by the number of its input line, so that it can be joined back to the input even though lines that hold no row, like the first line of adult.test.csv, are skipped. With `--num-workers`, the input is split between several processes.
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('writefile', 'trainer/predict.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport argparse\nimport io\nimport json\nimport multiprocessing\nimport os\nimport shutil\nimport tempfile\nimport time\n\nimport numpy as np\nimport pandas as pd\nimport tensorflow as tf\n\nfrom . import util\n\n# Number of input bytes parsed and preprocessed at a time.\nBLOCK_SIZE = 1 << 22\n\n# Number of rows scored per model call.\nBATCH_SIZE = 1024\n\n\ndef _features(text, input_format, preprocessing):\n    """Parses, preprocesses and standardizes a block of input lines.\n\n    Raw rows go through util.preprocess() and util.standardize() as a whole,\n    with the vocabularies and statistics the model was trained with. JSON\n    rows that are lists of numbers, like the ones in test.json, are taken as\n    already preprocessed. Lines that hold no row, such as blank lines or the\n    first line of adult.test, are skipped.\n\n    Args:\n      text: string of one or more lines\n      input_format: \'csv\' for census-format CSV rows, raw or cleaned, or\n        \'jsonl\' for one JSON value per line: an object keyed by census column\n        names, or a list of preprocessed features\n      preprocessing: dictionary returned by util.load_preprocessing()\n\n    Returns:\n      A tuple (rows, features) of the indices of the lines of text that hold\n      a row, and a float32 numpy array with the model inputs of those rows\n    """\n    lines = text.split(\'\\n\')\n    if input_format == \'csv\':\n        # util.clean_block() drops exactly the lines without a comma.\n        rows = [i for i, line in enumerate(lines) if \',\' in line]\n        if not rows:\n            return rows, np.zeros((0, 0), dtype=\'float32\')\n        text = util.clean_block(\'\\n\'.join(lines[i] for i in rows))\n        dataframe = pd.read_csv(io.StringIO(text), names=util.CSV_COLUMNS,\n                                na_values=\'?\', dtype=util.CSV_DTYPES)\n    else:\n        rows = [i for i, line in enumerate(lines) if line.strip()]\n        if not rows:\n            return rows, np.zeros((0, 0), dtype=\'float32\')\n        records = [json.loads(lines[i]) for i in rows]\n        if isinstance(records[0], list):\n            return rows, np.asarray(records, dtype=\'float32\')\n        dataframe = pd.DataFrame.from_records(records,\n                                              columns=util.CSV_COLUMNS)\n        dataframe = dataframe.replace(\'?\', np.nan).astype(util.CSV_DTYPES)\n\n    features = util.preprocess(dataframe,\n                               preprocessing[\'categorical_types\'])\n    features.pop(util.LABEL_COLUMN)\n    features = util.standardize(features, preprocessing[\'stats\'])\n    return rows, features.values.astype(\'float32\')\n\n\ndef load_model(model_dir):\n    """Loads an exported model as a function scoring batches of rows.\n\n    The model is wrapped in a tf.function with a fixed input signature, so it\n    is traced once and every call, whatever its batch size, runs the same\n    graph. This avoids the per-call overhead of Model.predict_on_batch(),\n    which dominates the latency of small batches.\n\n    Args:\n      model_dir: path of the keras_export SavedModel written by task.py\n\n    Returns:\n      A function mapping a float32 numpy array of model inputs to a float32\n      numpy array with one probability per row\n    """\n    keras_model = tf.keras.models.load_model(model_dir)\n    signature = tf.TensorSpec([None, keras_model.input_shape[-1]], tf.float32)\n\n    @tf.function(input_signature=[signature])\n    def score(features):\n        return keras_model(features, training=False)\n\n    return lambda features: score(features).numpy().reshape(-1)\n\n\ndef _format(line_numbers, probabilities, output_format):\n    """Formats probabilities, keyed by input line number, as output lines."""\n    if output_format == \'csv\':\n        return \'\'.join(\'%d,%r\\n\' % (n, float(p))\n                       for n, p in zip(line_numbers, probabilities))\n    return \'\'.join(json.dumps({\'line\': int(n), \'probability\': float(p)}) +\n                   \'\\n\' for n, p in zip(line_numbers, probabilities))\n\n\ndef _first_lines(input_path, ranges):\n    """Numbers, counted from 1, the first input line of every range."""\n    first_lines = [1]\n    with tf.io.gfile.GFile(input_path, \'rb\') as input_object:\n        for start, end in ranges[:-1]:\n            input_object.seek(start)\n            first_lines.append(first_lines[-1] + sum(\n                text.count(\'\\n\')\n                for text in util.iter_blocks(input_object, end)))\n    return first_lines\n\n\ndef _predict_range(args):\n    """Scores the input lines between two byte offsets.\n\n    Args:\n      args: tuple (model_dir, input_path, output_path, start, end,\n        first_line, preprocessing, input_format, output_format, batch_size,\n        block_size), where first_line is the number of the line at start\n\n    Returns:\n      A list with the latency in seconds of every model call\n    """\n    (model_dir, input_path, output_path, start, end, first_line,\n     preprocessing, input_format, output_format, batch_size,\n     block_size) = args\n    score = load_model(model_dir)\n\n    latencies = []\n    with tf.io.gfile.GFile(input_path, \'rb\') as input_object:\n        input_object.seek(start)\n        with tf.io.gfile.GFile(output_path, \'w\') as output_object:\n            for text in util.iter_blocks(input_object, end, block_size):\n                rows, features = _features(text, input_format, preprocessing)\n                outputs = []\n                for offset in range(0, len(features), batch_size):\n                    batch_start = time.time()\n                    outputs.append(score(features[offset:offset + batch_size]))\n                    latencies.append(time.time() - batch_start)\n                if outputs:\n                    output_object.write(_format(\n                        first_line + np.array(rows), np.concatenate(outputs),\n                        output_format))\n                # Blocks end on a line boundary, except maybe the last one.\n                first_line += text.count(\'\\n\')\n    return latencies\n\n\ndef predict(model_dir, input_path, output_path, batch_size=BATCH_SIZE,\n            num_workers=1, block_size=BLOCK_SIZE):\n    """Scores a census-format CSV or JSONL file with an exported model.\n\n    The input is read in blocks of block_size bytes. Each block is\n    preprocessed and standardized as a whole, then scored in batches of\n    batch_size rows, and its predictions are appended to the output, so\n    memory use does not depend on the size of the input. With num_workers > 1\n    the input is split on line boundaries and the parts are scored by\n    separate processes, each loading the model once; the output keeps the\n    order of the input.\n\n    Args:\n      model_dir: path of the keras_export SavedModel written by task.py\n      input_path: census rows in CSV (raw or cleaned), or JSONL when the path\n        ends with .json or .jsonl; see _features() for the accepted rows\n      output_path: file to write one prediction per input row to, keyed by\n        the number of its input line counted from 1: line,probability CSV\n        rows when the path ends with .csv, or JSONL objects with line and\n        probability keys otherwise\n      batch_size: number of rows per model call\n      num_workers: number of processes to score with\n      block_size: approximate number of input bytes processed at a time\n\n    Returns:\n      A dictionary with the number of rows scored, the elapsed seconds and\n      the latencies in seconds of every model call\n    """\n    preprocessing = util.load_preprocessing(model_dir)\n    input_format = (\'jsonl\' if input_path.endswith((\'.json\', \'.jsonl\'))\n                    else \'csv\')\n    output_format = \'csv\' if output_path.endswith(\'.csv\') else \'jsonl\'\n\n    start = time.time()\n    ranges = util.split_offsets(input_path, num_workers)\n    temp_dir = tempfile.mkdtemp()\n    try:\n        tasks = [(model_dir, input_path,\n                  os.path.join(temp_dir, \'part-%05d\' % i), range_start,\n                  range_end, first_line, preprocessing, input_format,\n                  output_format, batch_size, block_size)\n                 for i, ((range_start, range_end), first_line) in enumerate(\n                     zip(ranges, _first_lines(input_path, ranges)))]\n        if len(tasks) > 1:\n            # Spawn fresh processes rather than forking one that may already\n            # have initialized TensorFlow.\n            pool = multiprocessing.get_context(\'spawn\').Pool(len(tasks))\n            try:\n                results = pool.map(_predict_range, tasks)\n            finally:\n                pool.close()\n                pool.join()\n        else:\n            results = [_predict_range(task) for task in tasks]\n\n        num_rows = 0\n        with tf.io.gfile.GFile(output_path, \'wb\') as output_object:\n            for task in tasks:\n                with tf.io.gfile.GFile(task[2], \'rb\') as part_object:\n                    for line in part_object:\n                        num_rows += 1\n                        output_object.write(line)\n    finally:\n        shutil.rmtree(temp_dir, ignore_errors=True)\n\n    return {\n        \'rows\': num_rows,\n        \'seconds\': time.time() - start,\n        \'latencies\': [latency for result in results for latency in result],\n    }\n\n\ndef get_args():\n    """Argument parser.\n\n    Returns:\n      Dictionary of arguments.\n    """\n    parser = argparse.ArgumentParser()\n    parser.add_argument(\n        \'--model-dir\',\n        required=True,\n        help=\'keras_export directory written by trainer.task\')\n    parser.add_argument(\n        \'--input\',\n        required=True,\n        help=\'census-format CSV file, or JSONL file of objects keyed by \'\n             \'column name or of preprocessed rows like test.json\')\n    parser.add_argument(\n        \'--output\',\n        required=True,\n        help=\'file to write predictions to, keyed by input line number, CSV \'\n             \'if it ends with .csv and JSONL otherwise\')\n    parser.add_argument(\n        \'--batch-size\',\n        default=BATCH_SIZE,\n        type=int,\n        help=\'number of rows per model call, default=%d\' % BATCH_SIZE)\n    parser.add_argument(\n        \'--num-workers\',\n        default=1,\n        type=int,\n        help=\'number of processes to score with, default=1\')\n    args, _ = parser.parse_known_args()\n    return args\n\n\nif __name__ == \'__main__\':\n    args = get_args()\n    result = predict(args.model_dir, args.input, args.output,\n                     batch_size=args.batch_size, num_workers=args.num_workers)\n    latencies = np.array(result[\'latencies\']) * 1000\n    print(\'Scored {} rows in {:.3f}s ({:,.0f} rows/second)\'.format(\n        result[\'rows\'], result[\'seconds\'], result[\'rows\'] / result[\'seconds\']))\n    if len(latencies):\n        print(\'Batch latency: p50={:.2f}ms p95={:.2f}ms p99={:.2f}ms\'.format(\n            *np.percentile(latencies, [50, 95, 99])))')
+
+
+# server.py serves the exported model over HTTP for online prediction. It keeps the model in memory and accepts the same `{"instances": [...]}` requests as the online prediction service, with either preprocessed rows like the ones in test.json or raw census values keyed by column name. Raw values are encoded with lookup tables built once from the vocabularies saved with the model rather than with Pandas. Concurrent requests are coalesced into batches of at most `--max-batch-size` rows, waiting at most `--max-wait-ms` milliseconds for a batch to fill, and `GET /metrics` reports the latency percentiles and the queue depth.
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('writefile', 'trainer/server.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport argparse\nimport collections\nimport json\nimport sys\nimport threading\nimport time\n\nimport numpy as np\nfrom six.moves import BaseHTTPServer\nfrom six.moves import queue\nfrom six.moves import socketserver\n\nfrom . import predict\nfrom . import util\n\n# Maximum number of rows scored together in one model call.\nMAX_BATCH_SIZE = 256\n\n# Maximum number of milliseconds a request waits for others to batch with.\nMAX_WAIT_MS = 2.0\n\n# Number of recent requests the latency percentiles are computed over.\n_LATENCY_WINDOW = 10000\n\n\nclass FeatureEncoder(object):\n    """Turns raw census instances into model inputs without Pandas.\n\n    The categorical codes are looked up in the vocabularies saved with the\n    model, and the numerical columns are standardized with the saved\n    statistics, so that an instance gets exactly the features\n    util.preprocess() and util.standardize() would give it.\n    """\n\n    def __init__(self, preprocessing):\n        """Builds the lookup tables.\n\n        Args:\n          preprocessing: dictionary returned by util.load_preprocessing()\n        """\n        self.columns = preprocessing[\'columns\']\n        stats = preprocessing[\'stats\']\n        # Like the codes of a Pandas category, unknown values map to -1.\n        self._tables = {column: vocabulary for column, vocabulary\n                        in preprocessing[\'vocabularies\'].items()\n                        if column in self.columns}\n        self._means = np.array([stats[column][0] if column in stats else 0.\n                                for column in self.columns])\n        self._stds = np.array([stats[column][1] if column in stats else 1.\n                               for column in self.columns])\n\n    def _value(self, column, value):\n        table = self._tables.get(column)\n        if table is not None:\n            return table.get(value, -1)\n        if value is None or value == \'?\':\n            return np.nan\n        return float(value)\n\n    def encode(self, instances):\n        """Encodes a list of instances.\n\n        Args:\n          instances: list of objects keyed by census column names, which must\n            hold every column the model takes, or of lists of already\n            preprocessed features like the rows of test.json\n\n        Returns:\n          float32 numpy array of model inputs\n\n        Raises:\n          ValueError: if an instance can not be encoded\n        """\n        if not all(isinstance(instance, type(instances[0]))\n                   for instance in instances):\n            raise ValueError(\'Instances must all be objects or all be lists\')\n        if instances and isinstance(instances[0], list):\n            features = np.array(instances, dtype=\'float32\')\n            if features.ndim != 2 or features.shape[1] != len(self.columns):\n                raise ValueError(\'Expected instances of %d features\' %\n                                 len(self.columns))\n            return features\n        for i, instance in enumerate(instances):\n            if not isinstance(instance, dict):\n                raise ValueError(\'Instance %d is not an object\' % i)\n            missing = [column for column in self.columns\n                       if column not in instance]\n            if missing:\n                raise ValueError(\'Instance %d is missing %s\' %\n                                 (i, \', \'.join(missing)))\n        try:\n            rows = [[self._value(column, instance[column])\n                     for column in self.columns] for instance in instances]\n        except (TypeError, ValueError) as error:\n            raise ValueError(\'Invalid instance: %s\' % error)\n        features = np.array(rows, dtype=\'float64\').reshape(\n            (-1, len(self.columns)))\n        return ((features - self._means) / self._stds).astype(\'float32\')\n\n\nclass _Request(object):\n    """Instances waiting to be scored, and their predictions once scored."""\n\n    def __init__(self, features):\n        self.features = features\n        self.predictions = None\n        self.error = None\n        self.done = threading.Event()\n\n\nclass MicroBatcher(object):\n    """Coalesces concurrent requests into batches for one model.\n\n    A background thread takes the oldest waiting request, then keeps adding\n    waiting requests until the batch holds max_batch_size rows or max_wait\n    seconds have passed since it started, and scores them all in a single\n    model call.\n    """\n\n    def __init__(self, score, max_batch_size=MAX_BATCH_SIZE,\n                 max_wait=MAX_WAIT_MS / 1000):\n        """Starts the batching thread.\n\n        Args:\n          score: function mapping a float32 array of model inputs to one\n            probability per row, as returned by predict.load_model()\n          max_batch_size: maximum number of rows per model call; a single\n            larger request is scored on its own\n          max_wait: maximum number of seconds to wait for more requests\n        """\n        self._score = score\n        self._max_batch_size = max_batch_size\n        self._max_wait = max_wait\n        self._queue = queue.Queue()\n        self._lock = threading.Lock()\n        self._latencies = collections.deque(maxlen=_LATENCY_WINDOW)\n        self._batch_sizes = collections.deque(maxlen=_LATENCY_WINDOW)\n        self._pending = None\n        thread = threading.Thread(target=self._run)\n        thread.daemon = True\n        thread.start()\n\n    def predict(self, features):\n        """Scores rows together with the ones of concurrent calls.\n\n        Args:\n          features: float32 numpy array of model inputs\n\n        Returns:\n          float32 numpy array with one probability per row\n        """\n        start = time.time()\n        request = _Request(features)\n        self._queue.put(request)\n        request.done.wait()\n        with self._lock:\n            self._latencies.append(time.time() - start)\n        if request.error is not None:\n            raise request.error\n        return request.predictions\n\n    def _next_batch(self):\n        batch = [self._pending or self._queue.get()]\n        self._pending = None\n        size = len(batch[0].features)\n        deadline = time.time() + self._max_wait\n        while size < self._max_batch_size:\n            timeout = deadline - time.time()\n            try:\n                request = (self._queue.get(timeout=timeout) if timeout > 0\n                           else self._queue.get_nowait())\n            except queue.Empty:\n                break\n            if size + len(request.features) > self._max_batch_size:\n                # Leave it for the next batch rather than exceed the limit.\n                self._pending = request\n                break\n            batch.append(request)\n            size += len(request.features)\n        return batch\n\n    def _run(self):\n        while True:\n            batch = self._next_batch()\n            sizes = [len(request.features) for request in batch]\n            try:\n                predictions = self._score(np.concatenate(\n                    [request.features for request in batch]))\n                offsets = np.cumsum([0] + sizes)\n                for i, request in enumerate(batch):\n                    request.predictions = predictions[offsets[i]:\n                                                      offsets[i + 1]]\n            except Exception as error:  # pylint: disable=broad-except\n                for request in batch:\n                    request.error = error\n            with self._lock:\n                self._batch_sizes.append(sum(sizes))\n            for request in batch:\n                request.done.set()\n\n    def metrics(self):\n        """Returns latency percentiles, queue depth and batch statistics."""\n        with self._lock:\n            latencies = np.array(self._latencies) * 1000\n            batch_sizes = np.array(self._batch_sizes)\n        metrics = {\n            \'queue_depth\': self._queue.qsize() + (1 if self._pending else 0),\n            \'requests\': len(latencies),\n            \'batches\': len(batch_sizes),\n        }\n        if len(latencies):\n            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])\n            metrics.update(latency_p50_ms=p50, latency_p95_ms=p95,\n                           latency_p99_ms=p99,\n                           mean_batch_size=batch_sizes.mean())\n        return metrics\n\n\nclass _Handler(BaseHTTPServer.BaseHTTPRequestHandler):\n    """Serves POST /predict (or /) and GET /metrics."""\n\n    # Set by make_server().\n    encoder = None\n    batcher = None\n\n    def _reply(self, status, body):\n        data = json.dumps(body).encode(\'utf-8\')\n        self.send_response(status)\n        self.send_header(\'Content-Type\', \'application/json\')\n        self.send_header(\'Content-Length\', str(len(data)))\n        self.end_headers()\n        self.wfile.write(data)\n\n    def do_GET(self):  # pylint: disable=invalid-name\n        if self.path != \'/metrics\':\n            self._reply(404, {\'error\': \'Not found\'})\n            return\n        self._reply(200, self.batcher.metrics())\n\n    def do_POST(self):  # pylint: disable=invalid-name\n        if self.path not in (\'/\', \'/predict\'):\n            self._reply(404, {\'error\': \'Not found\'})\n            return\n        try:\n            length = int(self.headers.get(\'Content-Length\', 0))\n            body = json.loads(self.rfile.read(length).decode(\'utf-8\'))\n            instances = body[\'instances\']\n            if not isinstance(instances, list):\n                raise ValueError(\'"instances" must be a list\')\n            features = self.encoder.encode(instances)\n        except (KeyError, TypeError, ValueError) as error:\n            self._reply(400, {\'error\': \'Invalid request: %s\' % error})\n            return\n        try:\n            predictions = (self.batcher.predict(features) if len(features)\n                           else [])\n        except Exception as error:  # pylint: disable=broad-except\n            self._reply(500, {\'error\': \'Prediction failed: %s\' % error})\n            return\n        self._reply(200, {\'predictions\': [float(p) for p in predictions]})\n\n    def log_message(self, *args):\n        # Logging every request to stderr would cost more than scoring it.\n        pass\n\n\nclass _ThreadingServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):\n    daemon_threads = True\n\n\ndef make_server(model_dir, host=\'localhost\', port=8080,\n                max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):\n    """Creates an HTTP server holding an exported model in memory.\n\n    Every connection is handled in its own thread, which parses and encodes\n    its instances and then hands them to a MicroBatcher shared by all\n    connections.\n\n    Requests take the same {"instances": [...]} shape as the\n    online prediction service: every instance is either an object keyed by\n    census column names, with raw values like the ones in adult.data, or a\n    list of preprocessed features like the rows of test.json. The response is\n    {"predictions": [...]}, with one probability per instance.\n\n    Args:\n      model_dir: path of the keras_export SavedModel written by task.py\n      host: address to listen on\n      port: port to listen on, or 0 for any free port\n      max_batch_size: maximum number of rows per model call\n      max_wait_ms: maximum number of milliseconds a request waits for others\n        to batch with\n\n    Returns:\n      A server to call serve_forever() on\n    """\n    handler = type(\'Handler\', (_Handler,), {\n        \'encoder\': FeatureEncoder(util.load_preprocessing(model_dir)),\n        \'batcher\': MicroBatcher(predict.load_model(model_dir), max_batch_size,\n                                max_wait_ms / 1000),\n    })\n    return _ThreadingServer((host, port), handler)\n\n\ndef get_args():\n    """Argument parser.\n\n    Returns:\n      Dictionary of arguments.\n    """\n    parser = argparse.ArgumentParser()\n    parser.add_argument(\n        \'--model-dir\',\n        required=True,\n        help=\'keras_export directory written by trainer.task\')\n    parser.add_argument(\n        \'--host\',\n        default=\'localhost\',\n        help=\'address to listen on, default=localhost\')\n    parser.add_argument(\n        \'--port\',\n        default=8080,\n        type=int,\n        help=\'port to listen on, default=8080\')\n    parser.add_argument(\n        \'--max-batch-size\',\n        default=MAX_BATCH_SIZE,\n        type=int,\n        help=\'maximum number of rows per model call, default=%d\'\n             % MAX_BATCH_SIZE)\n    parser.add_argument(\n        \'--max-wait-ms\',\n        default=MAX_WAIT_MS,\n        type=float,\n        help=\'maximum number of milliseconds a request waits for others to \'\n             \'batch with, default=%g\' % MAX_WAIT_MS)\n    args, _ = parser.parse_known_args()\n    return args\n\n\nif __name__ == \'__main__\':\n    args = get_args()\n    server = make_server(args.model_dir, args.host, args.port,\n                         max_batch_size=args.max_batch_size,\n                         max_wait_ms=args.max_wait_ms)\n    print(\'Serving on http://{}:{}/predict\'.format(*server.server_address))\n    sys.stdout.flush()\n    server.serve_forever()')
+
+
+# sweep.py runs a local hyperparameter sweep. Rather than starting a separate training job for every combination of hyperparameters, which would load and preprocess the data every time, it loads the data once and shares it with parallel worker processes through shared memory, and stops trials whose validation loss falls behind the median of the other trials.
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('writefile', 'trainer/sweep.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport argparse\nimport itertools\nimport multiprocessing\nimport os\nimport shutil\nimport tempfile\nimport time\n\nimport numpy as np\nimport pandas as pd\nimport tensorflow as tf\n\nfrom . import cache\nfrom . import model\nfrom . import task\nfrom . import util\n\n# Shared memory file system the preprocessed data is written to, if present.\nSHARED_MEMORY_DIR = \'/dev/shm\'\n\nSUMMARY_FILE = \'sweep_summary.csv\'\n\n# Objectives to compare trials on, and whether lower values are better.\n_OBJECTIVES = {\'val_loss\': True, \'val_accuracy\': False}\n\n# State of each worker process, set by _init_worker().\n_worker = {}\n\n\nclass MedianStopping(tf.keras.callbacks.Callback):\n    """Stops a trial whose objective is worse than the median of its peers.\n\n    At the end of every epoch, the trial reports its objective to a board\n    shared by all trials. Once at least min_trials other trials have reported\n    the same epoch, the trial stops if it is worse than their median.\n    """\n\n    def __init__(self, board, trial, objective, min_trials, grace_epochs):\n        """Initializes the callback.\n\n        Args:\n          board: dictionary shared between processes, mapping (trial, epoch)\n            pairs to objective values\n          trial: number of this trial\n          objective: name of the validation metric to compare, a key of\n            _OBJECTIVES\n          min_trials: number of other trials needed to compare with\n          grace_epochs: number of epochs a trial runs before it can be stopped\n        """\n        super(MedianStopping, self).__init__()\n        self.board = board\n        self.trial = trial\n        self.objective = objective\n        self.min_trials = min_trials\n        self.grace_epochs = grace_epochs\n        self.stopped_epoch = None\n\n    def on_epoch_end(self, epoch, logs=None):\n        value = float(logs[self.objective])\n        self.board[(self.trial, epoch)] = value\n        if epoch + 1 < self.grace_epochs:\n            return\n        others = [other_value for (trial, other_epoch), other_value\n                  in self.board.items()\n                  if other_epoch == epoch and trial != self.trial]\n        if len(others) < self.min_trials:\n            return\n        median = np.median(others)\n        if (value > median if _OBJECTIVES[self.objective] else value < median):\n            self.model.stop_training = True\n            self.stopped_epoch = epoch + 1\n\n\ndef _init_worker(entry_dir, board, threads):\n    """Limits the threads of a worker process and maps the shared data."""\n    tf.config.threading.set_intra_op_parallelism_threads(threads)\n    tf.config.threading.set_inter_op_parallelism_threads(threads)\n    _worker[\'data\'] = cache.read_entry(entry_dir)\n    _worker[\'board\'] = board\n    _worker[\'threads\'] = threads\n\n\ndef _with_threads(dataset, threads):\n    options = tf.data.Options()\n    options.experimental_threading.private_threadpool_size = threads\n    return dataset.with_options(options)\n\n\ndef _run_trial(args):\n    """Trains one configuration in a worker process.\n\n    Args:\n      args: tuple (trial, hparams, objective, min_trials, grace_epochs), where\n        hparams is a dictionary with the learning_rate, batch_size and\n        num_epochs to train with\n\n    Returns:\n      A dictionary describing the trial and its results\n    """\n    trial, hparams, objective, min_trials, grace_epochs = args\n    train_x, train_y, eval_x, eval_y, _ = _worker[\'data\']\n    threads = _worker[\'threads\']\n    batch_size = hparams[\'batch_size\']\n    num_epochs = hparams[\'num_epochs\']\n\n    start = time.time()\n    tf.keras.backend.clear_session()\n    keras_model = model.create_keras_model(\n        input_dim=train_x.shape[1], learning_rate=hparams[\'learning_rate\'])\n    # The features are memory-mapped from shared memory. DataFrame.values\n    # returns the mapped array itself, which mapped_input_fn() never copies.\n    training_dataset = _with_threads(model.mapped_input_fn(\n        features=train_x.values,\n        labels=train_y,\n        shuffle=True,\n        num_epochs=num_epochs,\n        batch_size=batch_size), threads)\n    validation_dataset = _with_threads(model.mapped_input_fn(\n        features=eval_x.values,\n        labels=eval_y,\n        shuffle=False,\n        num_epochs=num_epochs,\n        batch_size=len(eval_x)), threads)\n\n    stopping_cb = MedianStopping(_worker[\'board\'], trial, objective,\n                                 min_trials, grace_epochs)\n    history = keras_model.fit(\n        training_dataset,\n        steps_per_epoch=int(len(train_x) / batch_size),\n        epochs=num_epochs,\n        validation_data=validation_dataset,\n        validation_steps=1,\n        verbose=0,\n        callbacks=[\n            tf.keras.callbacks.LearningRateScheduler(\n                task.learning_rate_schedule(hparams[\'learning_rate\'])),\n            stopping_cb,\n        ])\n\n    values = history.history[objective]\n    best = np.argmin(values) if _OBJECTIVES[objective] else np.argmax(values)\n    result = dict(hparams, trial=trial)\n    result.update({\n        \'epochs_run\': len(values),\n        \'stopped_early\': stopping_cb.stopped_epoch is not None,\n        \'best_epoch\': int(best) + 1,\n        \'val_loss\': history.history[\'val_loss\'][best],\n        \'val_accuracy\': history.history[\'val_accuracy\'][best],\n        \'seconds\': time.time() - start,\n    })\n    return result\n\n\ndef _report(result, objective):\n    print(\'Trial {}: {}={:.4f} after {} epoch(s){}\'.format(\n        result[\'trial\'], objective, result[objective], result[\'epochs_run\'],\n        \', stopped early\' if result[\'stopped_early\'] else \'\'))\n\n\ndef run_sweep(args):\n    """Runs every combination of the hyperparameters in parallel trials.\n\n    The data is downloaded and preprocessed once, then written as .npy files\n    to shared memory, where every worker process memory-maps it: the trials\n    share a single copy of the data instead of each loading their own. Worker\n    processes are spawned rather than forked, since TensorFlow does not\n    support forking a process that already initialized it, and each limits\n    TensorFlow to --threads-per-trial threads, so the trials running at the\n    same time use at most --oversubscription times the CPUs of the machine.\n\n    Args:\n      args: dictionary of arguments - see get_args() for details\n\n    Returns:\n      A Pandas dataframe with one row per trial, best trials first\n    """\n    start = time.time()\n    if args.cache_dir:\n        train_x, train_y, eval_x, eval_y, stats = cache.load_data(\n            args.cache_dir, args.cache_max_bytes)\n    else:\n        train_x, train_y, eval_x, eval_y, stats = util.read_data(\n            *util.download(util.DATA_DIR))\n\n    trials = [dict(learning_rate=learning_rate, batch_size=batch_size,\n                   num_epochs=args.num_epochs)\n              for learning_rate, batch_size in itertools.product(\n                  args.learning_rates, args.batch_sizes)]\n    num_cpus = multiprocessing.cpu_count()\n    max_trials = max(1, int(num_cpus * args.oversubscription //\n                            args.threads_per_trial))\n    parallel_trials = min(args.parallel_trials or max_trials, max_trials,\n                          len(trials))\n    print(\'Running {} trials, {} at a time with {} thread(s) each, on {} \'\n          \'CPUs\'.format(len(trials), parallel_trials, args.threads_per_trial,\n                        num_cpus))\n\n    shared_dir = tempfile.mkdtemp(\n        dir=SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else None)\n    try:\n        entry_dir = os.path.join(shared_dir, \'data\')\n        cache.write_entry(entry_dir, train_x, train_y, eval_x, eval_y, stats)\n        # Drop the parent\'s copy; the workers read the shared one.\n        del train_x, train_y, eval_x, eval_y\n\n        context = multiprocessing.get_context(\'spawn\')\n        manager = context.Manager()\n        try:\n            pool = context.Pool(\n                parallel_trials, initializer=_init_worker,\n                initargs=(entry_dir, manager.dict(), args.threads_per_trial))\n            try:\n                tasks = [(trial, hparams, args.objective, args.min_trials,\n                          args.grace_epochs)\n                         for trial, hparams in enumerate(trials)]\n                results = []\n                for result in pool.imap_unordered(_run_trial, tasks):\n                    _report(result, args.objective)\n                    results.append(result)\n            finally:\n                pool.close()\n                pool.join()\n        finally:\n            manager.shutdown()\n    finally:\n        shutil.rmtree(shared_dir, ignore_errors=True)\n\n    summary = pd.DataFrame(results, columns=[\n        \'trial\', \'learning_rate\', \'batch_size\', \'num_epochs\', \'epochs_run\',\n        \'stopped_early\', \'best_epoch\', \'val_loss\', \'val_accuracy\', \'seconds\'])\n    summary = summary.sort_values(\n        args.objective, ascending=_OBJECTIVES[args.objective])\n    tf.io.gfile.makedirs(args.job_dir)\n    with tf.io.gfile.GFile(os.path.join(args.job_dir, SUMMARY_FILE),\n                           \'w\') as summary_file:\n        summary.to_csv(summary_file, index=False)\n\n    elapsed = time.time() - start\n    print(summary.to_string(index=False))\n    print(\'Sweep took {:.1f}s for {:.1f}s of trials ({:.2f}x)\'.format(\n        elapsed, summary[\'seconds\'].sum(), summary[\'seconds\'].sum() / elapsed))\n    return summary\n\n\ndef get_args():\n    """Argument parser.\n\n    Returns:\n      Dictionary of arguments.\n    """\n    parser = argparse.ArgumentParser()\n    parser.add_argument(\n        \'--job-dir\',\n        type=str,\n        required=True,\n        help=\'local or GCS location for writing the summary of the sweep\')\n    parser.add_argument(\n        \'--learning-rates\',\n        default=[.01],\n        type=float,\n        nargs=\'+\',\n        help=\'learning rates to try, default=.01\')\n    parser.add_argument(\n        \'--batch-sizes\',\n        default=[128],\n        type=int,\n        nargs=\'+\',\n        help=\'batch sizes to try, default=128\')\n    parser.add_argument(\n        \'--num-epochs\',\n        type=int,\n        default=20,\n        help=\'maximum number of epochs of each trial, default=20\')\n    parser.add_argument(\n        \'--parallel-trials\',\n        type=int,\n        help=\'number of trials to run at the same time, default=as many as \'\n             \'the CPUs allow\')\n    parser.add_argument(\n        \'--threads-per-trial\',\n        default=1,\n        type=int,\n        help=\'number of TensorFlow threads of each trial, default=1\')\n    parser.add_argument(\n        \'--oversubscription\',\n        default=1.,\n        type=float,\n        help=\'maximum ratio of the threads of the running trials to the \'\n             \'CPUs, default=1\')\n    parser.add_argument(\n        \'--objective\',\n        choices=sorted(_OBJECTIVES),\n        default=\'val_loss\',\n        help=\'validation metric to compare trials on, default=val_loss\')\n    parser.add_argument(\n        \'--min-trials\',\n        default=3,\n        type=int,\n        help=\'number of other trials that must have reached an epoch before \'\n             \'a trial can be stopped for being worse than their median, \'\n             \'default=3\')\n    parser.add_argument(\n        \'--grace-epochs\',\n        default=2,\n        type=int,\n        help=\'number of epochs every trial runs before it can be stopped, \'\n             \'default=2\')\n    parser.add_argument(\n        \'--cache-dir\',\n        type=str,\n        help=\'local directory for caching the preprocessed data between runs, \'\n             \'disabled by default\')\n    parser.add_argument(\n        \'--cache-max-bytes\',\n        default=cache.CACHE_MAX_BYTES,\n        type=int,\n        help=\'maximum size of --cache-dir in bytes, default=%d\'\n             % cache.CACHE_MAX_BYTES)\n    args, _ = parser.parse_known_args()\n    return args\n\n\nif __name__ == \'__main__\':\n    run_sweep(get_args())')
+
+
+# quantize.py converts the exported model to TensorFlow Lite for fast CPU serving, optionally with float16 weights or with int8 weights and activations, whose ranges are calibrated on a sample of the training data.
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('writefile', 'trainer/quantize.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport os\n\nimport numpy as np\nimport tensorflow as tf\n\n# Directory, under the job directory, the TensorFlow Lite models are\n# exported to.\nTFLITE_DIR = \'tflite\'\n\n# Precisions the model can be exported with.\nVARIANTS = (\'float32\', \'float16\', \'int8\')\n\n# Number of training rows the int8 quantization ranges are calibrated on.\nCALIBRATION_SIZE = 1000\n\n\ndef sample_rows(features, size=CALIBRATION_SIZE, seed=0):\n    """Draws a random sample of rows to calibrate quantization with.\n\n    Args:\n      features: numpy array of preprocessed training features\n      size: maximum number of rows to draw\n      seed: seed of the random sample\n\n    Returns:\n      float32 numpy array of at most size rows\n    """\n    size = min(size, len(features))\n    rows = np.random.RandomState(seed).choice(len(features), size,\n                                              replace=False)\n    return np.asarray(features[np.sort(rows)], dtype=\'float32\')\n\n\ndef convert(model_dir, variant, calibration_features=None):\n    """Converts an exported model to TensorFlow Lite.\n\n    float16 stores the weights as half-precision floats, which halves the\n    model size. int8 quantizes the weights and the activations to 8-bit\n    integers using ranges measured on calibration_features; the model still\n    takes and returns float32 values.\n\n    Args:\n      model_dir: path of the keras_export SavedModel written by task.py\n      variant: one of VARIANTS\n      calibration_features: float32 numpy array of preprocessed training\n        rows, required for int8\n\n    Returns:\n      The TensorFlow Lite flatbuffer, as bytes\n    """\n    converter = tf.lite.TFLiteConverter.from_saved_model(model_dir)\n    if variant == \'float16\':\n        converter.optimizations = [tf.lite.Optimize.DEFAULT]\n        converter.target_spec.supported_types = [tf.float16]\n    elif variant == \'int8\':\n        if calibration_features is None:\n            raise ValueError(\'int8 quantization needs calibration features\')\n        converter.optimizations = [tf.lite.Optimize.DEFAULT]\n        converter.target_spec.supported_ops = [\n            tf.lite.OpsSet.TFLITE_BUILTINS_INT8]\n        converter.representative_dataset = lambda: (\n            [row[np.newaxis]] for row in calibration_features)\n    elif variant != \'float32\':\n        raise ValueError(\'Unknown variant %r\' % variant)\n    return converter.convert()\n\n\ndef export(model_dir, export_dir, variants, calibration_features=None):\n    """Exports TensorFlow Lite variants of a model.\n\n    Args:\n      model_dir: path of the keras_export SavedModel written by task.py\n      export_dir: directory to write model_<variant>.tflite files to\n      variants: list of VARIANTS to export\n      calibration_features: float32 numpy array of preprocessed training\n        rows, required for int8\n\n    Returns:\n      Dictionary mapping each variant to the path of its file\n    """\n    tf.io.gfile.makedirs(export_dir)\n    paths = {}\n    for variant in variants:\n        paths[variant] = os.path.join(export_dir, \'model_%s.tflite\' % variant)\n        with tf.io.gfile.GFile(paths[variant], \'wb\') as model_file:\n            model_file.write(convert(model_dir, variant, calibration_features))\n    return paths\n\n\nclass TFLiteModel(object):\n    """Scores batches of rows with a TensorFlow Lite model.\n\n    Like the function returned by predict.load_model(), an instance maps a\n    float32 numpy array of model inputs to one probability per row.\n    """\n\n    def __init__(self, model_path):\n        with tf.io.gfile.GFile(model_path, \'rb\') as model_file:\n            self._interpreter = tf.lite.Interpreter(\n                model_content=model_file.read())\n        self._input = self._interpreter.get_input_details()[0][\'index\']\n        self._output = self._interpreter.get_output_details()[0][\'index\']\n        self._batch_size = None\n\n    def __call__(self, features):\n        if len(features) != self._batch_size:\n            # Reallocating is only needed when the batch size changes.\n            self._interpreter.resize_tensor_input(self._input, features.shape)\n            self._interpreter.allocate_tensors()\n            self._batch_size = len(features)\n        self._interpreter.set_tensor(self._input, features)\n        self._interpreter.invoke()\n        return self._interpreter.get_tensor(self._output).reshape(-1)')
+
+
+# One more file, benchmark.py, holds micro-benchmarks for the training package. Its `clean` benchmark compares the block-based CSV cleaning in util.py, which processes several megabytes of lines at a time with bulk string and regular expression operations and can split large files across processes, against the original line-by-line loop, and checks that both produce byte-identical output.
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('writefile', 'trainer/benchmark.py', 'from __future__ import absolute_import\nfrom __future__ import division\nfrom __future__ import print_function\n\nimport argparse\nimport json\nimport os\nimport shutil\nimport socket\nimport subprocess\nimport sys\nimport tempfile\nimport threading\nimport time\n\nimport numpy as np\nimport pandas as pd\nfrom six.moves import urllib\nimport tensorflow as tf\n\nfrom . import model\nfrom . import predict\nfrom . import quantize\nfrom . import server\nfrom . import task\nfrom . import util\n\n\ndef _clean_file_per_line(source, destination):\n    """Reference implementation: the original per-line cleaning loop."""\n    with tf.io.gfile.GFile(source, \'r\') as temp_file_object:\n        with tf.io.gfile.GFile(destination, \'w\') as file_object:\n            for line in temp_file_object:\n                line = line.strip()\n                line = line.replace(\', \', \',\')\n                if not line or \',\' not in line:\n                    continue\n                if line[-1] == \'.\':\n                    line = line[:-1]\n                line += \'\\n\'\n                file_object.write(line)\n\n\ndef _count_lines(file_path):\n    with tf.io.gfile.GFile(file_path, \'rb\') as file_object:\n        return sum(block.count(b\'\\n\') for block in iter(\n            lambda: file_object.read(util.CLEAN_BLOCK_SIZE), b\'\'))\n\n\ndef _read_bytes(file_path):\n    with tf.io.gfile.GFile(file_path, \'rb\') as file_object:\n        return file_object.read()\n\n\ndef benchmark_clean(args):\n    """Compares the throughput of the CSV cleaning implementations.\n\n    Every implementation cleans the same raw file, which is built by repeating\n    the raw census training file --repeat times, and its output is checked to\n    be byte-identical to the one of the original per-line loop.\n    """\n    temp_dir = tempfile.mkdtemp()\n    try:\n        source = os.path.join(temp_dir, \'raw.csv\')\n        with tf.io.gfile.GFile(source, \'wb\') as source_object:\n            raw = _read_bytes(args.source)\n            for _ in range(args.repeat):\n                source_object.write(raw)\n        num_lines = _count_lines(source)\n\n        candidates = [(\'per-line loop\', _clean_file_per_line)]\n        for num_processes in args.processes:\n            candidates.append((\n                \'blocks, %d process(es)\' % num_processes,\n                lambda s, d, n=num_processes: util.clean_file(s, d, n)))\n\n        print(\'{:<28}{:>14}{:>16}  {}\'.format(\n            \'implementation\', \'seconds\', \'lines/second\', \'output\'))\n        reference = None\n        for name, clean in candidates:\n            destination = os.path.join(temp_dir, \'clean.csv\')\n            start = time.time()\n            clean(source, destination)\n            elapsed = time.time() - start\n            output = _read_bytes(destination)\n            if reference is None:\n                reference = output\n            print(\'{:<28}{:>14.3f}{:>16,.0f}  {}\'.format(\n                name, elapsed, num_lines / elapsed,\n                \'identical\' if output == reference else \'DIFFERENT\'))\n    finally:\n        shutil.rmtree(temp_dir, ignore_errors=True)\n\n\ndef benchmark_input(args):\n    """Measures the throughput of input_fn() in each pipeline configuration.\n\n    The pipelines read random data shaped like the preprocessed census\n    features, and are iterated without a model, so the numbers are the\n    upper bound the input pipeline puts on training speed.\n    """\n    features = np.random.rand(args.num_examples,\n                              args.input_dim).astype(\'float32\')\n    labels = np.random.randint(\n        2, size=(args.num_examples, 1)).astype(\'float32\')\n\n    configurations = [\n        (\'basic, full shuffle\', dict(fast=False)),\n        (\'basic, shuffle %d\' % args.shuffle_buffer_size,\n         dict(fast=False, shuffle_buffer_size=args.shuffle_buffer_size)),\n        (\'fast, full shuffle\', dict(fast=True)),\n        (\'fast, shuffle %d\' % args.shuffle_buffer_size,\n         dict(fast=True, shuffle_buffer_size=args.shuffle_buffer_size)),\n        (\'fast, nondeterministic\', dict(fast=True, deterministic=False)),\n    ]\n\n    print(\'{:<28}{:>14}{:>18}\'.format(\n        \'pipeline\', \'seconds\', \'examples/second\'))\n    for name, kwargs in configurations:\n        dataset = model.input_fn(\n            features=features,\n            labels=labels,\n            shuffle=True,\n            num_epochs=args.num_epochs,\n            batch_size=args.batch_size,\n            **kwargs)\n        # Consume the batches with reduce() rather than a Python loop, which\n        # would be the bottleneck at these rates.\n        start = time.time()\n        dataset.reduce(np.int64(0), lambda count, _: count + 1).numpy()\n        elapsed = time.time() - start\n        print(\'{:<28}{:>14.3f}{:>18,.0f}\'.format(\n            name, elapsed, args.num_examples * args.num_epochs / elapsed))\n\n\ndef benchmark_predict(args):\n    """Measures batch prediction throughput and latency per batch size.\n\n    Scores --input with the model in --model-dir once per batch size and\n    number of workers.\n    """\n    temp_dir = tempfile.mkdtemp()\n    try:\n        print(\'{:>8}{:>12}{:>12}{:>14}{:>12}{:>12}\'.format(\n            \'workers\', \'batch size\', \'seconds\', \'rows/second\', \'p50 ms\',\n            \'p95 ms\'))\n        for num_workers in args.workers:\n            for batch_size in args.batch_sizes:\n                result = predict.predict(\n                    args.model_dir, args.input,\n                    os.path.join(temp_dir, \'predictions.csv\'),\n                    batch_size=batch_size, num_workers=num_workers)\n                latencies = np.array(result[\'latencies\']) * 1000\n                print((\'{:>8}{:>12}{:>12.3f}{:>14,.0f}{:>12.2f}\'\n                       \'{:>12.2f}\').format(\n                    num_workers, batch_size, result[\'seconds\'],\n                    result[\'rows\'] / result[\'seconds\'],\n                    *np.percentile(latencies, [50, 95])))\n    finally:\n        shutil.rmtree(temp_dir, ignore_errors=True)\n\n\ndef benchmark_serve(args):\n    """Measures the online prediction server under concurrent load.\n\n    For each maximum batch size, starts a server in this process and sends\n    --num-requests requests of --instances-per-request raw eval rows from\n    each of --clients concurrent client threads, then prints the throughput\n    and the latency and batching metrics the server reports.\n    """\n    _, eval_file_path = util.download(util.DATA_DIR)\n    with tf.io.gfile.GFile(eval_file_path, \'r\') as eval_file:\n        rows = [line.rstrip(\'\\n\').split(\',\') for _, line in\n                zip(range(args.instances_per_request), eval_file)]\n    body = json.dumps({\'instances\': [dict(zip(util.CSV_COLUMNS, row))\n                                     for row in rows]}).encode(\'utf-8\')\n\n    print(\'{:>10}{:>10}{:>16}{:>10}{:>10}{:>10}{:>12}{:>8}\'.format(\n        \'max batch\', \'wait ms\', \'requests/sec\', \'p50 ms\', \'p95 ms\', \'p99 ms\',\n        \'mean batch\', \'queue\'))\n    for max_batch_size in args.max_batch_sizes:\n        httpd = server.make_server(\n            args.model_dir, port=0, max_batch_size=max_batch_size,\n            max_wait_ms=args.max_wait_ms)\n        thread = threading.Thread(target=httpd.serve_forever)\n        thread.daemon = True\n        thread.start()\n        url = \'http://%s:%d\' % httpd.server_address\n\n        def client():\n            for _ in range(args.num_requests):\n                urllib.request.urlopen(url + \'/predict\', body).read()\n\n        try:\n            # Trace the model before timing.\n            urllib.request.urlopen(url + \'/predict\', body).read()\n            clients = [threading.Thread(target=client)\n                       for _ in range(args.clients)]\n            start = time.time()\n            for client_thread in clients:\n                client_thread.start()\n            # Sample the queue depth while the clients run.\n            depths = []\n            while any(client_thread.is_alive() for client_thread in clients):\n                depths.append(json.loads(urllib.request.urlopen(\n                    url + \'/metrics\').read().decode(\'utf-8\'))[\'queue_depth\'])\n                time.sleep(0.01)\n            elapsed = time.time() - start\n            metrics = json.loads(urllib.request.urlopen(\n                url + \'/metrics\').read().decode(\'utf-8\'))\n        finally:\n            httpd.shutdown()\n            httpd.server_close()\n        print((\'{:>10}{:>10g}{:>16,.0f}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.1f}\'\n               \'{:>8.1f}\').format(\n                   max_batch_size, args.max_wait_ms,\n                   args.clients * args.num_requests / elapsed,\n                   metrics[\'latency_p50_ms\'], metrics[\'latency_p95_ms\'],\n                   metrics[\'latency_p99_ms\'], metrics[\'mean_batch_size\'],\n                   np.mean(depths) if depths else 0.))\n\n\ndef _auc(labels, scores):\n    """Computes the area under the ROC curve from the ranks of the scores.\n\n    Tied scores, which quantized models produce many of, get their average\n    rank.\n    """\n    labels = np.asarray(labels, dtype=bool)\n    ranks = pd.Series(scores).rank().values\n    num_positives = labels.sum()\n    num_negatives = len(labels) - num_positives\n    return ((ranks[labels].sum() - num_positives * (num_positives + 1) / 2) /\n            (num_positives * num_negatives))\n\n\ndef _model_size(path):\n    """Returns the size in bytes of a model file or directory."""\n    if not tf.io.gfile.isdir(path):\n        return tf.io.gfile.stat(path).length\n    return sum(tf.io.gfile.stat(os.path.join(directory, name)).length\n               for directory, _, names in tf.io.gfile.walk(path)\n               for name in names)\n\n\ndef benchmark_quantize(args):\n    """Compares the TensorFlow Lite variants of a model with the original.\n\n    Reads the eval file and preprocesses it with the statistics and\n    vocabularies saved with the model in --job-dir, then scores it with the\n    float32 SavedModel and with every TensorFlow Lite model exported with\n    task.py --tflite-variants. Reports the size of each model, its median\n    latency for a single row, its throughput in batches of --batch-size, and\n    the difference of its accuracy and AUC from the float32 SavedModel.\n    """\n    model_dir = os.path.join(args.job_dir, \'keras_export\')\n    preprocessing = util.load_preprocessing(model_dir)\n    _, eval_file_path = util.download(util.DATA_DIR)\n    dataframe = pd.read_csv(eval_file_path, names=util.CSV_COLUMNS,\n                            na_values=\'?\', dtype=util.CSV_DTYPES)\n    features = util.preprocess(dataframe, preprocessing[\'categorical_types\'])\n    labels = features.pop(util.LABEL_COLUMN).values\n    features = util.standardize(\n        features, preprocessing[\'stats\']).values.astype(\'float32\')\n\n    candidates = [(\'SavedModel\', model_dir, predict.load_model(model_dir))]\n    for variant in quantize.VARIANTS:\n        path = os.path.join(args.job_dir, quantize.TFLITE_DIR,\n                            \'model_%s.tflite\' % variant)\n        if tf.io.gfile.exists(path):\n            candidates.append((\'TFLite \' + variant, path,\n                               quantize.TFLiteModel(path)))\n\n    print(\'{:<16}{:>10}{:>12}{:>14}{:>10}{:>10}{:>10}{:>10}\'.format(\n        \'model\', \'KiB\', \'row us\', \'rows/second\', \'accuracy\', \'delta\',\n        \'AUC\', \'delta\'))\n    baseline = None\n    for name, path, score in candidates:\n        row = features[:1]\n        score(row)\n        latencies = []\n        for _ in range(args.num_runs):\n            start = time.time()\n            score(row)\n            latencies.append(time.time() - start)\n\n        score(features[:args.batch_size])\n        start = time.time()\n        probabilities = np.concatenate([\n            score(features[offset:offset + args.batch_size])\n            for offset in range(0, len(features), args.batch_size)])\n        elapsed = time.time() - start\n\n        accuracy = np.mean((probabilities > 0.5) == labels)\n        auc = _auc(labels, probabilities)\n        if baseline is None:\n            baseline = accuracy, auc\n        print((\'{:<16}{:>10.1f}{:>12.1f}{:>14,.0f}{:>10.4f}{:>+10.4f}\'\n               \'{:>10.4f}{:>+10.4f}\').format(\n                   name, _model_size(path) / 1024.,\n                   np.median(latencies) * 1e6, len(features) / elapsed,\n                   accuracy, accuracy - baseline[0], auc, auc - baseline[1]))\n\n\ndef _free_port():\n    sock = socket.socket()\n    sock.bind((\'localhost\', 0))\n    port = sock.getsockname()[1]\n    sock.close()\n    return port\n\n\ndef benchmark_scaling_worker(args):\n    """Trains on random data as one worker of a local multi-worker cluster.\n\n    The cluster is described by TF_CONFIG. The chief prints its measured\n    throughput as a JSON line.\n    """\n    strategy = task.get_strategy(\'multi-worker\')\n    batch_size = args.batch_size * strategy.num_replicas_in_sync\n\n    features = np.random.rand(args.num_examples,\n                              args.input_dim).astype(\'float32\')\n    labels = np.random.randint(\n        2, size=(args.num_examples, 1)).astype(\'float32\')\n    with strategy.scope():\n        keras_model = model.create_keras_model(\n            input_dim=args.input_dim, learning_rate=0.01)\n    dataset = strategy.experimental_distribute_dataset(model.input_fn(\n        features=features,\n        labels=labels,\n        shuffle=True,\n        num_epochs=None,\n        batch_size=batch_size,\n        fast=True))\n\n    # The first steps build the graphs and connect the workers.\n    keras_model.fit(dataset, steps_per_epoch=args.warmup_steps, epochs=1,\n                    verbose=0)\n    start = time.time()\n    keras_model.fit(dataset, steps_per_epoch=args.num_steps, epochs=1,\n                    verbose=0)\n    elapsed = time.time() - start\n    if task.is_chief_task():\n        print(json.dumps({\n            \'batch_size\': batch_size,\n            \'seconds\': elapsed,\n            \'examples_per_second\': args.num_steps * batch_size / elapsed,\n        }))\n\n\ndef benchmark_scaling(args):\n    """Measures how training throughput scales with local worker processes.\n\n    For each cluster size, starts that many worker processes on this machine,\n    connected through TF_CONFIG, and trains with MultiWorkerMirroredStrategy\n    and a fixed --batch-size per worker, as task.py does.\n    """\n    print(\'{:>8}{:>14}{:>14}{:>18}{:>10}\'.format(\n        \'workers\', \'global batch\', \'seconds\', \'examples/second\', \'speedup\'))\n    baseline = None\n    for num_workers in args.workers:\n        cluster = {\'worker\': [\'localhost:%d\' % _free_port()\n                              for _ in range(num_workers)]}\n        processes = []\n        for index in range(num_workers):\n            env = dict(os.environ, TF_CONFIG=json.dumps({\n                \'cluster\': cluster,\n                \'task\': {\'type\': \'worker\', \'index\': index},\n            }))\n            command = [\n                sys.executable, \'-m\', \'trainer.benchmark\', \'scaling-worker\',\n                \'--num-examples\', str(args.num_examples),\n                \'--input-dim\', str(args.input_dim),\n                \'--batch-size\', str(args.batch_size),\n                \'--num-steps\', str(args.num_steps),\n                \'--warmup-steps\', str(args.warmup_steps),\n            ]\n            processes.append(subprocess.Popen(\n                command, env=env, stdout=subprocess.PIPE))\n        outputs = [process.communicate()[0] for process in processes]\n        if any(process.returncode for process in processes):\n            raise RuntimeError(\'A worker of the %d worker cluster failed\' %\n                               num_workers)\n\n        result = json.loads(outputs[0].decode(\'utf-8\').strip().split(\'\\n\')[-1])\n        throughput = result[\'examples_per_second\']\n        if baseline is None:\n            baseline = throughput / num_workers\n        print(\'{:>8}{:>14}{:>14.3f}{:>18,.0f}{:>9.2f}x\'.format(\n            num_workers, result[\'batch_size\'], result[\'seconds\'], throughput,\n            throughput / baseline))\n\n\ndef _add_scaling_arguments(parser):\n    """Adds the arguments shared by the scaling benchmark and its workers."""\n    parser.add_argument(\n        \'--num-examples\',\n        default=100000,\n        type=int,\n        help=\'number of examples in the dataset, default=100000\')\n    parser.add_argument(\n        \'--input-dim\',\n        default=11,\n        type=int,\n        help=\'number of features per example, default=11\')\n    parser.add_argument(\n        \'--batch-size\',\n        default=128,\n        type=int,\n        help=\'number of examples per batch on each worker, default=128\')\n    parser.add_argument(\n        \'--num-steps\',\n        default=200,\n        type=int,\n        help=\'number of training steps to time, default=200\')\n    parser.add_argument(\n        \'--warmup-steps\',\n        default=20,\n        type=int,\n        help=\'number of untimed training steps, default=20\')\n\n\ndef get_args():\n    """Argument parser.\n\n    Returns:\n      Dictionary of arguments.\n    """\n    parser = argparse.ArgumentParser()\n    subparsers = parser.add_subparsers(dest=\'benchmark\')\n    subparsers.required = True\n\n    clean_parser = subparsers.add_parser(\n        \'clean\', help=\'compare CSV cleaning implementations\')\n    clean_parser.add_argument(\n        \'--source\',\n        required=True,\n        help=\'raw (uncleaned) census CSV file, e.g. a copy of adult.data\')\n    clean_parser.add_argument(\n        \'--repeat\',\n        default=10,\n        type=int,\n        help=\'number of times to repeat the source file, default=10\')\n    clean_parser.add_argument(\n        \'--processes\',\n        default=[1, 4],\n        type=int,\n        nargs=\'+\',\n        help=\'numbers of processes to run the block cleaner with, \'\n             \'default=1 4\')\n    clean_parser.set_defaults(func=benchmark_clean)\n\n    input_parser = subparsers.add_parser(\n        \'input\', help=\'compare input pipeline configurations\')\n    input_parser.add_argument(\n        \'--num-examples\',\n        default=1000000,\n        type=int,\n        help=\'number of examples in the dataset, default=1000000\')\n    input_parser.add_argument(\n        \'--input-dim\',\n        default=11,\n        type=int,\n        help=\'number of features per example, default=11\')\n    input_parser.add_argument(\n        \'--num-epochs\',\n        default=1,\n        type=int,\n        help=\'number of times to go through the data, default=1\')\n    input_parser.add_argument(\n        \'--batch-size\',\n        default=128,\n        type=int,\n        help=\'number of examples per batch, default=128\')\n    input_parser.add_argument(\n        \'--shuffle-buffer-size\',\n        default=10000,\n        type=int,\n        help=\'bounded shuffle buffer size to compare against a full \'\n             \'shuffle, default=10000\')\n    input_parser.set_defaults(func=benchmark_input)\n\n    predict_parser = subparsers.add_parser(\n        \'predict\', help=\'measure batch prediction across batch sizes\')\n    predict_parser.add_argument(\n        \'--model-dir\',\n        required=True,\n        help=\'keras_export directory written by trainer.task\')\n    predict_parser.add_argument(\n        \'--input\',\n        required=True,\n        help=\'census-format CSV or JSONL file to score\')\n    predict_parser.add_argument(\n        \'--batch-sizes\',\n        default=[64, 1024, 8192],\n        type=int,\n        nargs=\'+\',\n        help=\'numbers of rows per model call to compare, \'\n             \'default=64 1024 8192\')\n    predict_parser.add_argument(\n        \'--workers\',\n        default=[1],\n        type=int,\n        nargs=\'+\',\n        help=\'numbers of processes to compare, default=1\')\n    predict_parser.set_defaults(func=benchmark_predict)\n\n    serve_parser = subparsers.add_parser(\n        \'serve\', help=\'measure the online prediction server under load\')\n    serve_parser.add_argument(\n        \'--model-dir\',\n        required=True,\n        help=\'keras_export directory written by trainer.task\')\n    serve_parser.add_argument(\n        \'--max-batch-sizes\',\n        default=[1, 32, 256],\n        type=int,\n        nargs=\'+\',\n        help=\'maximum numbers of rows per model call to compare, \'\n             \'default=1 32 256\')\n    serve_parser.add_argument(\n        \'--max-wait-ms\',\n        default=server.MAX_WAIT_MS,\n        type=float,\n        help=\'maximum milliseconds a request waits to be batched, \'\n             \'default=%g\' % server.MAX_WAIT_MS)\n    serve_parser.add_argument(\n        \'--clients\',\n        default=16,\n        type=int,\n        help=\'number of concurrent client threads, default=16\')\n    serve_parser.add_argument(\n        \'--num-requests\',\n        default=200,\n        type=int,\n        help=\'number of requests sent by each client, default=200\')\n    serve_parser.add_argument(\n        \'--instances-per-request\',\n        default=1,\n        type=int,\n        help=\'number of instances in each request, default=1\')\n    serve_parser.set_defaults(func=benchmark_serve)\n\n    quantize_parser = subparsers.add_parser(\n        \'quantize\', help=\'compare quantized TensorFlow Lite models\')\n    quantize_parser.add_argument(\n        \'--job-dir\',\n        required=True,\n        help=\'job directory of trainer.task, run with --tflite-variants\')\n    quantize_parser.add_argument(\n        \'--batch-size\',\n        default=1024,\n        type=int,\n        help=\'number of rows per call when measuring throughput, \'\n             \'default=1024\')\n    quantize_parser.add_argument(\n        \'--num-runs\',\n        default=1000,\n        type=int,\n        help=\'number of single-row calls to take the median latency of, \'\n             \'default=1000\')\n    quantize_parser.set_defaults(func=benchmark_quantize)\n\n    scaling_parser = subparsers.add_parser(\n        \'scaling\', help=\'measure training throughput across local workers\')\n    _add_scaling_arguments(scaling_parser)\n    scaling_parser.add_argument(\n        \'--workers\',\n        default=[1, 2, 4],\n        type=int,\n        nargs=\'+\',\n        help=\'numbers of local worker processes to compare, default=1 2 4\')\n    scaling_parser.set_defaults(func=benchmark_scaling)\n\n    worker_parser = subparsers.add_parser(\n        \'scaling-worker\', help=\'run one worker of the scaling benchmark\')\n    _add_scaling_arguments(worker_parser)\n    worker_parser.set_defaults(func=benchmark_scaling_worker)\n    return parser.parse_args()\n\n\nif __name__ == \'__main__\':\n    args = get_args()\n    args.func(args)')
+
+
+# Run the cleaning benchmark on the raw training file, repeated to get a larger input:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\npython -m trainer.benchmark clean \\\n    --source data/adult.data.csv \\\n    --repeat 10 \\\n    --processes 1 4')
+
+
+# task.py can also build a faster input pipeline with `--input-pipeline fast`: it shuffles example indices instead of the examples themselves, so even a full shuffle needs little memory, gathers each batch in a parallel map, and prefetches batches while the model trains. `--shuffle-buffer-size` bounds the shuffle buffer, `--nondeterministic` lets parallel stages return batches out of order, and with `--stream`, `--dataset-cache` caches the parsed data in a local temporary directory during the first epoch, which is removed once training ends. When training under a `tf.distribute` strategy, the datasets are sharded across workers automatically. The `input` benchmark reports the examples per second of each configuration:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\npython -m trainer.benchmark input \\\n    --num-examples 1000000 \\\n    --batch-size 128')
+
+
+# Training in task.py is data-parallel: `--batch-size` is the batch size of each replica, every step processes one such batch on every replica of the distribution strategy, and the learning rate is scaled by the number of replicas to match the larger global batch. By default, task.py uses `MirroredStrategy` across the devices of the machine, or `MultiWorkerMirroredStrategy` when the `TF_CONFIG` environment variable describes a cluster with several workers (override with `--distribution`). The `scaling` benchmark starts 1, 2 and 4 local worker processes connected through `TF_CONFIG` and reports how the training throughput scales:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\npython -m trainer.benchmark scaling \\\n    --workers 1 2 4')
+
+
+# To tune the learning rate and the batch size, run a sweep over every combination of the values below. The trials run in parallel, as many at a time as there are CPUs, with one TensorFlow thread each by default. A trial is stopped once it is worse than the median of at least `--min-trials` other trials at the same epoch. The summary of the trials, best first, is written to sweep_summary.csv in the job directory:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\npython -m trainer.sweep \\\n    --job-dir output/sweep \\\n    --learning-rates 0.001 0.003 0.01 0.03 \\\n    --batch-sizes 64 128 512 \\\n    --num-epochs 10')
 
 
 # #### Step 2.2: Run a training job locally using the Python training program
@@ -93,6 +189,14 @@ get_ipython().run_cell_magic('writefile', 'trainer/task.py', 'from __future__ im
 get_ipython().run_cell_magic('bash', '', '\nMODEL_DIR=output\ngcloud ai-platform local train \\\n    --module-name trainer.task \\\n    --package-path trainer/ \\\n    --job-dir $MODEL_DIR \\\n    -- \\\n    --train-files $TRAIN_DATA \\\n    --eval-files $EVAL_DATA \\\n    --train-steps 1000 \\\n    --eval-steps 100')
 
 
+# If the census files are too large to fit in memory, add the `--stream` flag. The CSV files are then read in chunks of `--chunk-size` rows: a first pass computes the means and standard deviations used for the z-scores, and the training and evaluation data is streamed through a `tf.data` pipeline, so memory use depends on the chunk size rather than on the file size:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\nMODEL_DIR=output\ngcloud ai-platform local train \\\n    --module-name trainer.task \\\n    --package-path trainer/ \\\n    --job-dir $MODEL_DIR \\\n    -- \\\n    --stream \\\n    --chunk-size 10000')
+
+
 # Check if the output has been written to the output folder:
 
 # In[10]:
@@ -101,6 +205,40 @@ get_ipython().run_cell_magic('bash', '', '\nMODEL_DIR=output\ngcloud ai-platform
 get_ipython().run_cell_magic('bash', '', '\nls output/keras_export/')
 
 
+# Next to the model, task.py saves the statistics that the numerical columns were standardized with, the number of rows they were computed over and the code of every category, so that predictions can preprocess their inputs exactly like the training data without reading it again. The file is in the `assets.extra` directory of the SavedModel, which model loaders ignore:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\nhead -n 30 output/keras_export/assets.extra/preprocessing.json')
+
+
+# task.py also writes metrics.json to the job directory. It records the seconds spent in each phase of the job, such as reading, preprocessing and standardizing the data, and, for every epoch, the training throughput in examples per second, percentiles of the step time, and the seconds the steps spent waiting for the input pipeline to produce their batches, measured from when each batch leaves the pipeline, along with the number of input-bound steps that spent most of their time waiting. Weight histograms for TensorBoard are off by default since computing them slows down training; turn them on with `--histogram-freq`. To see where the time of a few steps goes, trace them with the TensorFlow profiler with `--profile-steps FIRST,LAST` and open the Profile tab of TensorBoard.
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\npython -m json.tool output/metrics.json | head -n 40')
+
+
+# When new census rows arrive, the model does not need to be trained again from scratch. `--warm-start-dir` loads the model exported by a previous job and fine-tunes it on the CSV files given with `--new-data`, which can be raw like adult.data or already cleaned. The statistics saved with the previous model are updated with the new rows only, so the old data is not read again to compute them. To keep the model from forgetting the old data, `--replay-size` adds a random sample of the original training rows. Fine-tuning uses a constant `--learning-rate`, usually lower than the one of the first training. With `--checkpoint`, the weights and optimizer state are saved to the `checkpoints` directory of the job at the end of every epoch, and running the same command again after an interruption resumes from the last completed epoch.
+
+# This lab has no newly collected census rows, so stand in for them with the last 2,000 rows of adult.data:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\ntail -n 2000 data/adult.data.csv > data/new_adult.data.csv')
+
+
+# Then fine-tune the model trained earlier on them:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\nMODEL_DIR=output_update\ngcloud ai-platform local train \\\n    --module-name trainer.task \\\n    --package-path trainer/ \\\n    --job-dir $MODEL_DIR \\\n    -- \\\n    --warm-start-dir output/keras_export \\\n    --new-data data/new_adult.data.csv \\\n    --replay-size 5000 \\\n    --learning-rate .001 \\\n    --num-epochs 5 \\\n    --checkpoint')
+
+
 # #### Step 2.3: Prepare input for prediction
 # 
 # To receive valid and useful predictions, you must preprocess input for prediction in the same way that training data was preprocessed. In a production system, you may want to create a preprocessing pipeline that can be used identically at training time and prediction time.
@@ -170,6 +308,46 @@ get_ipython().run_cell_magic('bash', '', '\ngcloud ai-platform local predict \\\
 
 # Since the model's last layer uses a sigmoid function for its activation, outputs between 0 and 0.5 represent negative predictions **("<=50K")** and outputs between 0.5 and 1 represent positive ones **(">50K")**.
 
+# `gcloud ai-platform local predict` is meant for a handful of instances. To score a whole file locally, use predict.py, which accepts raw census rows as well as preprocessed rows like the ones in test.json:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\npython -m trainer.predict \\\n    --model-dir output/keras_export/ \\\n    --input data/adult.test.csv \\\n    --output predictions.csv')
+
+
+# Larger batches amortize the cost of each model call, at the price of a higher latency per batch. The `predict` benchmark reports the throughput and the batch latency for several batch sizes:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\npython -m trainer.benchmark predict \\\n    --model-dir output/keras_export/ \\\n    --input data/adult.test.csv \\\n    --batch-sizes 64 1024 8192')
+
+
+# For serving at high throughput on CPUs, task.py can also export the model to TensorFlow Lite with `--tflite-variants`: `float16` halves the size of the weights, and `int8` quantizes weights and activations to 8-bit integers using ranges measured on `--calibration-size` training rows. The `quantize` benchmark compares the size, single-row latency, batch throughput, accuracy and AUC of each variant on adult.test.csv against the float32 SavedModel:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\npython -m trainer.task \\\n    --job-dir output/quantized \\\n    --tflite-variants float32 float16 int8\npython -m trainer.benchmark quantize --job-dir output/quantized')
+
+
+# Start the prediction server in the background, and send it the instances in test.json:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\nnohup python -m trainer.server --model-dir output/keras_export/ --port 8080 > server.log 2>&1 &\nsleep 10\npython -c "import json; print(json.dumps({\'instances\': [json.loads(line) for line in open(\'test.json\')]}))" > request.json\ncurl -s -d @request.json http://localhost:8080/predict\ncurl -s http://localhost:8080/metrics')
+
+
+# Larger batches let the server score more requests per second, while the wait for a batch to fill adds to the latency of each request. The `serve` benchmark starts a server for each maximum batch size and sends it concurrent requests:
+
+# In[ ]:
+
+
+get_ipython().run_cell_magic('bash', '', '\npkill -f trainer.server\npython -m trainer.benchmark serve \\\n    --model-dir output/keras_export/ \\\n    --max-batch-sizes 1 32 256 \\\n    --clients 16')
+
+
 # ### Step 3: Run your training job in the cloud
 # 
 # Now that you've validated your model by running it locally, you will now get practice training using Cloud AI Platform.